@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+DUKE spin-up -> industrial / traceability runs as a pipeline.
+
+The SPIN_UP, POST_INDUST and SPIN_UP_SIMS blocks of
+duke_spinup_to_equilibrium.main are stages, see runGday/scripts/pipeline.py.
+The industrial and traceability runs both only need the spun-up state so
+they run at the same time, and rerunning skips any stage whose cfg, met,
+parameters or driver code haven't changed, e.g.
+
+    python duke_pipeline.py 2
+"""
+import os
+import sys
+
+import duke_spinup_to_equilibrium as duke
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (14.12.2014)"
+__email__   = "mdekauwe@gmail.com"
+
+def build(experiment_id, site):
+    base_dir = os.path.dirname(os.getcwd())
+    param_dir = os.path.join(base_dir, "params")
+    met_dir = os.path.join(base_dir, "met_data")
+    run_dir = os.path.join(base_dir, "outputs")
+    sys.path.append(os.path.join(os.path.dirname(base_dir), "scripts"))
+    import pipeline as pl
+
+    p = pl.Pipeline(os.path.join(base_dir, "cache", "pipeline"))
+    tag = "%s_%s" % (experiment_id, site)
+    spunup_fname = os.path.join(param_dir, tag + "_model_spunup.cfg")
+    flags = {"SPIN_UP": False, "POST_INDUST": False, "SPIN_UP_SIMS": False}
+
+    p.add(pl.Stage(tag + "_spin_up", duke.main,
+                   inputs=[os.path.join(duke.BASE_PARAM_DIR, "base_start.cfg"),
+                           os.path.join(met_dir,
+                           "%s_met_data_equilibrium_50_yrs.csv" % site)],
+                   outputs=[spunup_fname],
+                   params=dict(flags, experiment_id=experiment_id, site=site,
+                               SPIN_UP=True)))
+    p.add(pl.Stage(tag + "_post_indust", duke.main,
+                   inputs=[spunup_fname,
+                           os.path.join(met_dir,
+                           "%s_met_data_industrial_to_present_1850_1983.csv" \
+                           % site)],
+                   outputs=[os.path.join(param_dir, tag + "_model_indust.cfg")],
+                   params=dict(flags, experiment_id=experiment_id, site=site,
+                               POST_INDUST=True)))
+    p.add(pl.Stage(tag + "_traceability", duke.main,
+                   inputs=[spunup_fname] +
+                          [os.path.join(met_dir,
+                           "%s_met_data_%s_traceability_equilib.csv" % \
+                           (site, t)) for t in ["preindust", "amb", "ele"]],
+                   outputs=[os.path.join(run_dir, "D1GDAY%s%s.csv" % (site, s))
+                            for s in ["SU280", "SUAMB", "SUELE"]],
+                   params=dict(flags, experiment_id=experiment_id, site=site,
+                               SPIN_UP_SIMS=True)))
+
+    return p
+
+def main(experiment_id, site, nworkers=None, force=False):
+
+    p = build(experiment_id, site)
+    status = p.run(nworkers=nworkers, force=force)
+    for stage in p.stages:
+        print "%-30s %s" % (stage.name, status[stage.name])
+
+    return status
+
+if __name__ == "__main__":
+
+    experiment_id = "NCEAS"
+    site = "DUKE"
+    nworkers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    main(experiment_id, site, nworkers=nworkers)
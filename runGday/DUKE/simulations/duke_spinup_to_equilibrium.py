@@ -21,44 +21,58 @@ change.
 """
 
 import os
-import shutil
 import sys
 import subprocess
 import numpy as np
-from gday import gday as model
-from gday import adjust_gday_param_file as ad
 from gday._version import __version__ as git_revision
 
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (14.12.2014)"
 __email__   = "mdekauwe@gmail.com"
 
+# where base_start.cfg lives
+BASE_PARAM_DIR = "/Users/mq42056055/Documents/gdayFresh/example/params"
 
-def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, SPIN_UP_SIMS=True):
+
+def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, SPIN_UP_SIMS=True,
+         use_cache=True, spin_up_tol=None, max_cycles=1000,
+         archive_cfg=False, profile=False):
+    """ With profile the cost of each stage goes to a manifest next to each
+    stage's out_fname, see run_profiler.py. With spin_up_tol the met is 
+    recycled until the pools settle, for at most max_cycles cycles. A spin-up
+    that doesn't settle is carried on from but not cached, see 
+    spinup_controller.py """
     base_dir = os.path.dirname(os.getcwd())
     
     # dir names
     base_param_name = "base_start"
     base_dir = os.path.dirname(os.getcwd())
-    base_param_dir = "/Users/mq42056055/Documents/gdayFresh/example/params"
+    base_param_dir = BASE_PARAM_DIR
     param_dir = os.path.join(base_dir, "params")
     met_dir = os.path.join(base_dir, "met_data")
     run_dir = os.path.join(base_dir, "outputs")
+    cache_dir = os.path.join(base_dir, "cache", "spinup")
+    
+    # site independent helpers live one level up
+    sys.path.append(os.path.join(os.path.dirname(base_dir), "scripts"))
+    import spinup_controller as spc
+    import gday_config as gc
+    import run_profiler as rp
+    import fork_runner as fr
+    
+    profiler = rp.RunProfiler(enabled=profile, git_revision=str(git_revision),
+                              experiment_id=experiment_id, site=site)
     
     
     if SPIN_UP == True:
     
-        # copy base files to make two new experiment files
-        shutil.copy(os.path.join(base_param_dir, base_param_name + ".cfg"),                
-                    os.path.join(param_dir, "%s_%s_model_spinup.cfg" % \
-                    (experiment_id, site)))
-        
         # Run model to equilibrium assuming forest, growing C pools from effectively
         # zero
         itag = "%s_%s_model_spinup" % (experiment_id, site)
         otag = "%s_%s_model_spunup" % (experiment_id, site)
         mtag = "%s_met_data_equilibrium_50_yrs.csv" % (site)
         out_fn = itag + "_equilib.out" 
+        base_cfg_fname = os.path.join(base_param_dir, base_param_name + ".cfg")
         out_param_fname = os.path.join(param_dir, otag + ".cfg")
         cfg_fname = os.path.join(param_dir, itag + ".cfg")
         met_fname = os.path.join(met_dir, mtag)
@@ -244,18 +258,24 @@ def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, SPIN_UP_SIMS=True)
                          "water_stress": "true",
                          
                         }
-        ad.adjust_param_file(cfg_fname, replace_dict)
-        G = model.Gday(cfg_fname, spin_up=True)
-        G.spin_up_pools()
+        # recycle the met until the pools stop changing (with spin_up_tol),
+        # or reuse the cached spun-up state
+        trace_fname = os.path.join(run_dir, otag + "_convergence.csv")
+        spc.spin_up(base_cfg_fname, replace_dict, met_fname, out_param_fname,
+                    trace_fname, git_revision, cache_dir, use_cache=use_cache,
+                    tol=spin_up_tol, max_cycles=max_cycles,
+                    cfg_fname=cfg_fname if archive_cfg else None,
+                    profiler=profiler)
+        profiler.write(out_fname)
         
     
     if POST_INDUST == True:
     
         # run for 200 odd years post industrial with increasing co2/ndep
         # we are swapping forest params for grass params now
-        # copy spunup base files to make two new experiment files
-        shutil.copy(os.path.join(param_dir, "%s_%s_model_spunup.cfg" % (experiment_id, site)),
-                    os.path.join(param_dir, "%s_%s_model_spunup_adj.cfg" % (experiment_id, site)))
+        # start from the spunup state
+        spunup_fname = os.path.join(param_dir, "%s_%s_model_spunup.cfg" % \
+                                    (experiment_id, site))
         
         itag = "%s_%s_model_spunup_adj" % (experiment_id, site)
         otag = "%s_%s_model_indust" % (experiment_id, site)
@@ -378,130 +398,74 @@ def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, SPIN_UP_SIMS=True)
                          "water_stress": "true",
                          
                         }
-        ad.adjust_param_file(cfg_fname, replace_dict)
-        G = model.Gday(cfg_fname)
-        G.run_sim()
+        config = gc.GdayConfig.read(spunup_fname).overlay(replace_dict)
+        if archive_cfg:
+            config.write(cfg_fname)
+        with profiler.stage("run_sim %s" % out_fn) as counts:
+            with config.model() as G:
+                G.run_sim()
+            if profile:
+                counts["days"] += rp.count_days(met_fname)
+        profiler.write(out_fname)
    
 
     if SPIN_UP_SIMS:
     
-        #
-        ## Equilib
-        #
-    
-        # copy spunup base files to make two new experiment files
-        shutil.copy(os.path.join(param_dir, "%s_%s_model_spunup.cfg" % (experiment_id, site)),
-                    os.path.join(param_dir, "%s_%s_model_spunup_trace.cfg" % (experiment_id, site)))
-    
-        itag = "%s_%s_model_spunup_trace" % (experiment_id, site)
-        otag = "%s_%s_model_indust" % (experiment_id, site)
-        mtag = "%s_met_data_preindust_traceability_equilib.csv" % (site)
-        out_fn = "D1GDAY%sSU280.csv" % (site)
-        out_param_fname = os.path.join(param_dir, otag + ".cfg")
-        cfg_fname = os.path.join(param_dir, itag + ".cfg")
-        met_fname = os.path.join(met_dir, mtag)
-        out_fname = os.path.join(run_dir, out_fn)
-        replace_dict = { 
-                         # git stuff
-                         "git_hash": str(git_revision),
-                     
-                         # files
-                         "out_param_fname": "%s" % (out_param_fname),
-                         "cfg_fname": "%s" % (cfg_fname),
-                         "met_fname": "%s" % (met_fname),
-                         "out_fname": "%s" % (out_fname),
-                         
-                         "print_options": "daily",
-                        }
-        ad.adjust_param_file(cfg_fname, replace_dict)
-        G = model.Gday(cfg_fname)
-        G.run_sim()
-    
-        # translate output to NCEAS style output
-
-        # add this directory to python search path so we can find the scripts!
-        sys.path.append(os.path.join(base_dir, "scripts"))
-        import translate_GDAY_output_to_NCEAS_format as tr
-        tr.translate_output(out_fname, met_fname)
-    
-    
-        #
-        ## Equilib - amb
-        #
-    
-        # copy spunup base files to make two new experiment files
-        shutil.copy(os.path.join(param_dir, "%s_%s_model_spunup.cfg" % (experiment_id, site)),
-                    os.path.join(param_dir, "%s_%s_model_spunup_trace.cfg" % (experiment_id, site)))
-    
-        itag = "%s_%s_model_spunup_trace" % (experiment_id, site)
-        otag = "%s_%s_model_indust" % (experiment_id, site)
-        mtag = "%s_met_data_amb_traceability_equilib.csv" % (site)
-        out_fn = "D1GDAY%sSUAMB.csv" % (site)
-        out_param_fname = os.path.join(param_dir, otag + ".cfg")
-        cfg_fname = os.path.join(param_dir, itag + ".cfg")
-        met_fname = os.path.join(met_dir, mtag)
-        out_fname = os.path.join(run_dir, out_fn)
-        replace_dict = { 
-                         # git stuff
-                         "git_hash": str(git_revision),
-                         
-                         # files
-                         "out_param_fname": "%s" % (out_param_fname),
-                         "cfg_fname": "%s" % (cfg_fname),
-                         "met_fname": "%s" % (met_fname),
-                         "out_fname": "%s" % (out_fname),
-                     
-                         "print_options": "daily",
-                        }
-        ad.adjust_param_file(cfg_fname, replace_dict)
-        G = model.Gday(cfg_fname)
-        G.run_sim()
-    
-        # translate output to NCEAS style output
-
-        # add this directory to python search path so we can find the scripts!
-        sys.path.append(os.path.join(base_dir, "scripts"))
-        import translate_GDAY_output_to_NCEAS_format as tr
-        tr.translate_output(out_fname, met_fname)
-    
-        #
-        ## Equilib - ele
-        #
-    
-        # copy spunup base files to make two new experiment files
-        shutil.copy(os.path.join(param_dir, "%s_%s_model_spunup.cfg" % (experiment_id, site)),
-                    os.path.join(param_dir, "%s_%s_model_spunup_trace.cfg" % (experiment_id, site)))
-    
-        itag = "%s_%s_model_spunup_trace" % (experiment_id, site)
-        otag = "%s_%s_model_indust" % (experiment_id, site)
-        mtag = "%s_met_data_ele_traceability_equilib.csv" % (site)
-        out_fn = "D1GDAY%sSUELE.csv" % (site)
-        out_param_fname = os.path.join(param_dir, otag + ".cfg")
-        cfg_fname = os.path.join(param_dir, itag + ".cfg")
-        met_fname = os.path.join(met_dir, mtag)
-        out_fname = os.path.join(run_dir, out_fn)
-        replace_dict = { 
-                         # git stuff
-                         "git_hash": str(git_revision),
+        # the preindustrial (280 ppm), amb and ele equilibrium runs all start
+        # from the same spunup state, so load it once and fork it into one
+        # process per scenario, each with its own cfg and output files
+        spunup_fname = os.path.join(param_dir, "%s_%s_model_spunup.cfg" % \
+                                    (experiment_id, site))
+        spunup = gc.GdayConfig.read(spunup_fname)
+        
+        scenarios = []
+        for (forcing, tag) in [("preindust", "SU280"), ("amb", "SUAMB"), 
+                               ("ele", "SUELE")]:
+            itag = "%s_%s_model_spunup_trace_%s" % (experiment_id, site, 
+                                                    forcing)
+            otag = "%s_%s_model_trace_%s" % (experiment_id, site, forcing)
+            mtag = "%s_met_data_%s_traceability_equilib.csv" % (site, forcing)
+            out_fn = "D1GDAY%s%s.csv" % (site, tag)
+            out_param_fname = os.path.join(param_dir, otag + ".cfg")
+            cfg_fname = os.path.join(param_dir, itag + ".cfg")
+            met_fname = os.path.join(met_dir, mtag)
+            out_fname = os.path.join(run_dir, out_fn)
+            replace_dict = { 
+                             # git stuff
+                             "git_hash": str(git_revision),
                          
-                         # files
-                         "out_param_fname": "%s" % (out_param_fname),
-                         "cfg_fname": "%s" % (cfg_fname),
-                         "met_fname": "%s" % (met_fname),
-                         "out_fname": "%s" % (out_fname),
-                     
-                         "print_options": "daily",
-                        }
-        ad.adjust_param_file(cfg_fname, replace_dict)
-        G = model.Gday(cfg_fname)
-        G.run_sim()
-    
-        # translate output to NCEAS style output
+                             # files
+                             "out_param_fname": "%s" % (out_param_fname),
+                             "cfg_fname": "%s" % (cfg_fname),
+                             "met_fname": "%s" % (met_fname),
+                             "out_fname": "%s" % (out_fname),
+                             
+                             "print_options": "daily",
+                            }
+            if archive_cfg:
+                spunup.overlay(replace_dict).write(cfg_fname)
+            scenarios.append((out_fn, replace_dict))
+        
+        with profiler.stage("run_sim traceability") as counts:
+            fr.fork_scenarios(spunup, scenarios)
+            if profile:
+                counts["days"] += sum(rp.count_days(rd["met_fname"]) 
+                                      for (out_fn, rd) in scenarios)
+        # the runs go together, so they get a manifest of their own
+        profiler.write(os.path.join(run_dir, "%s_%s_traceability" % \
+                                    (experiment_id, site)))
+    
+        # translate output to NCEAS style output, one after the other here 
+        # once the runs are done
 
         # add this directory to python search path so we can find the scripts!
         sys.path.append(os.path.join(base_dir, "scripts"))
         import translate_GDAY_output_to_NCEAS_format as tr
-        tr.translate_output(out_fname, met_fname)
+        for (out_fn, replace_dict) in scenarios:
+            out_fname = replace_dict["out_fname"]
+            with profiler.stage("translate_output %s" % out_fn):
+                tr.translate_output(out_fname, replace_dict["met_fname"])
+            profiler.write(out_fname, scenario=out_fn)
 
 
 
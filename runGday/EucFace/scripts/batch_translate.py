@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Translate a batch of G'DAY outputs to NCEAS format on a process pool
+
+After a parameter sweep there are hundreds of outputs to convert. Each file
+is translated in place by its own worker (translate_output writes to a
+unique temp file next to the output, so they can't trip over each other).
+The met forcing for each output is either one file for the lot (--met) or
+found in --met-dir from the EucFACE output name, i.e.
+
+    D1GDAY<site><alloc_model><AMB|ELE><AVG|VAR>.csv
+        -> <site>_met_data_<amb|ele>_<avg|var>_co2.csv
+
+Outputs compressed with gzip (.csv.gz) or zstd (.csv.zst) are picked up
+too and stay compressed.
+
+A manifest (by default .translation_manifest.json in the directory the
+outputs share) records for each output the hash of the G'DAY output it came
+from, of its met forcing and of the translator, along with the hash, size and
+mtime of the NCEAS file. Rerunning the batch then only translates new G'DAY
+outputs. Anything the manifest shows is up to date is skipped on its size and
+mtime, without reading it. A file which is already NCEAS but was made with
+other met forcing or an older translator is reported as stale. Its G'DAY
+output is gone, so the run has to be redone. NCEAS files the manifest
+doesn't know, e.g. translated by the simulation driver, are left alone. e.g.
+
+    python batch_translate.py --met-dir ../met_data -n 8 ../outputs/sweep
+    python batch_translate.py --met ../met_data/EUC_met_data_amb_avg_co2.csv \\
+        "../outputs/sweep/*/D1GDAYEUCFIXEDAMBAVG.csv"
+"""
+import os
+import re
+import sys
+import glob
+import json
+import time
+import fnmatch
+import inspect
+import argparse
+import traceback
+import multiprocessing as mp
+import translate_GDAY_output_to_EUCFACE_format as tr
+# the translator has put runGday/scripts on the path
+from file_utils import file_hash, atomic_write
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (14.12.2014)"
+__email__   = "mdekauwe@gmail.com"
+
+# plain or compressed csv, not e.g. the columnar .npy/.json or the profile
+# manifests that sit next to them
+CSV_EXT = r"\.csv(\.gz|\.zstd?)?$"
+
+def find_outputs(paths, pattern="D1GDAY*.csv*"):
+    """ G'DAY outputs in the directories (searched recursively, for names
+    matching pattern), globs and files given, in sorted order. Only .csv
+    files, compressed or not, are picked up """
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for (dirpath, dirnames, fnames) in os.walk(path):
+                found.update(os.path.join(dirpath, f) for f in fnames
+                             if fnmatch.fnmatch(f, pattern))
+        else:
+            found.update(f for f in glob.glob(path) if os.path.isfile(f))
+
+    return sorted(f for f in found if re.search(CSV_EXT, f))
+
+def match_met(fname, met_dir, site="EUC"):
+    """ The met forcing the EucFACE output fname was run with """
+    match = re.match(r"D1GDAY%s.*(AMB|ELE)(AVG|VAR)%s" % (site, CSV_EXT),
+                     os.path.basename(fname))
+    if match is None:
+        raise ValueError("can't tell the met forcing for %s" % fname)
+    (treatment, exp) = match.groups()[:2]
+
+    return os.path.join(met_dir, "%s_met_data_%s_%s_co2.csv" % \
+                        (site, treatment.lower(), exp.lower()))
+
+def translator_hash():
+    """ A change to the translator source makes every output stale """
+    return file_hash(inspect.getsourcefile(tr))
+
+def default_manifest(fnames):
+    """ .translation_manifest.json in the directory the outputs share """
+    prefix = os.path.commonprefix([os.path.abspath(f) for f in fnames])
+
+    return os.path.join(os.path.dirname(prefix), ".translation_manifest.json")
+
+def load_manifest(manifest_fname):
+    """ {output, relative to the manifest: entry} """
+    try:
+        with open(manifest_fname) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def write_manifest(manifest, manifest_fname):
+    with atomic_write(manifest_fname) as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def translate_job(job):
+    """ Translate fname unless the manifest entry shows it is up to date.
+    Runs in the worker, hands back the traceback rather than raising so one
+    bad file doesn't lose the rest of the batch
+
+    Returns:
+    --------
+    fname : string
+    status : string
+        translated, skipped, stale (NCEAS already, but from other met or an
+        older translator), untracked (NCEAS already, but not translated by
+        us) or failed
+    entry : dictionary
+        the new manifest entry, or the traceback if it failed
+    """
+    (fname, met_fname, columnar, entry, met_sha1, tr_sha1) = job
+    try:
+        st = os.stat(fname)
+        if entry is not None and (entry["size"], entry["mtime"]) == \
+           (st.st_size, st.st_mtime) and \
+           (entry["met_sha1"], entry["translator_sha1"]) == (met_sha1, tr_sha1):
+            return fname, "skipped", entry
+
+        if tr.is_translated(fname):
+            # e.g. translated by the simulation driver as it ran
+            if entry is None or entry["sha1"] != file_hash(fname):
+                return fname, "untracked", None
+            entry = dict(entry, size=st.st_size, mtime=st.st_mtime)
+            if (entry["met_sha1"], entry["translator_sha1"]) != \
+               (met_sha1, tr_sha1):
+                return fname, "stale", entry
+            return fname, "skipped", entry
+
+        source_sha1 = file_hash(fname)
+        tr.translate_output(fname, met_fname, columnar=columnar)
+        st = os.stat(fname)
+        entry = {"source_sha1": source_sha1, "met_fname": met_fname,
+                 "met_sha1": met_sha1, "translator_sha1": tr_sha1,
+                 "sha1": file_hash(fname), "size": st.st_size,
+                 "mtime": st.st_mtime,
+                 "translated": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        return fname, "translated", entry
+    except Exception:
+        return fname, "failed", traceback.format_exc()
+
+def translate_batch(jobs, nworkers=None, manifest_fname=None):
+    """ Translate every (fname, met_fname, columnar) job that isn't up to date
+
+    Parameters:
+    ----------
+    jobs : list
+        (G'DAY output, its met forcing, also write the columnar copy)
+    nworkers : int
+        number of worker processes, None uses all the cores we have
+    manifest_fname : string
+        the translation manifest, default see default_manifest
+
+    Returns:
+    --------
+    status : dictionary
+        {fname: translated, skipped, stale, untracked or failed}, see
+        translate_job
+    errors : dictionary
+        {fname: traceback} for the failures
+    """
+    if not jobs:
+        return {}, {}
+    if manifest_fname is None:
+        manifest_fname = default_manifest([job[0] for job in jobs])
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_fname))
+    manifest = load_manifest(manifest_fname)
+    key = lambda fname: os.path.relpath(os.path.abspath(fname), manifest_dir)
+
+    # hash each met file and the translator once, not once per output
+    tr_sha1 = translator_hash()
+    met_sha1 = dict((met_fname, file_hash(met_fname))
+                    for met_fname in set(job[1] for job in jobs)
+                    if os.path.exists(met_fname))
+    jobs = [(fname, met_fname, columnar, manifest.get(key(fname)),
+             met_sha1.get(met_fname), tr_sha1)
+            for (fname, met_fname, columnar) in jobs]
+
+    pool = mp.Pool(processes=nworkers)
+    try:
+        # chunksize=1, file sizes vary a lot between spin-up and experiments
+        results = pool.map(translate_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    (status, errors) = ({}, {})
+    for (fname, state, entry) in results:
+        status[fname] = state
+        if state == "failed":
+            errors[fname] = entry
+        elif state == "untracked":
+            manifest.pop(key(fname), None)
+        else:
+            manifest[key(fname)] = entry
+    write_manifest(manifest, manifest_fname)
+
+    return status, errors
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Translate G'DAY outputs "
+                                     "to NCEAS format in parallel")
+    parser.add_argument("paths", nargs="+",
+                        help="directories, globs or G'DAY output files")
+    met = parser.add_mutually_exclusive_group(required=True)
+    met.add_argument("--met", help="met forcing for all the outputs")
+    met.add_argument("--met-dir", help="pick each output's met forcing "
+                     "from this directory by its name")
+    parser.add_argument("--site", default="EUC")
+    parser.add_argument("--pattern", default="D1GDAY*.csv*",
+                        help="outputs to pick up in the directories")
+    parser.add_argument("-n", "--nworkers", type=int, default=None)
+    parser.add_argument("--columnar", action="store_true",
+                        help="also write the binary columnar copy")
+    parser.add_argument("--manifest", default=None,
+                        help="translation manifest, default "
+                        ".translation_manifest.json where the outputs are")
+    args = parser.parse_args(args)
+
+    fnames = find_outputs(args.paths, args.pattern)
+    (jobs, unmatched) = ([], [])
+    for f in fnames:
+        if args.met is not None:
+            jobs.append((f, args.met, args.columnar))
+            continue
+        try:
+            jobs.append((f, match_met(f, args.met_dir, args.site), 
+                         args.columnar))
+        except ValueError as e:
+            sys.stderr.write("skipping %s\n" % e)
+            unmatched.append(f)
+
+    (status, errors) = translate_batch(jobs, args.nworkers, args.manifest)
+    status.update((f, "skipped") for f in unmatched)
+    for fname in sorted(status):
+        if status[fname] == "failed":
+            sys.stderr.write("%s failed\n%s\n" % (fname, errors[fname]))
+        elif status[fname] == "stale":
+            sys.stderr.write("%s is out of date but already translated, "
+                             "rerun it\n" % fname)
+    states = status.values()
+    print ", ".join("%d %s" % (states.count(s), s) for s in
+                    ["translated", "skipped", "stale", "untracked", 
+                     "failed"])
+
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
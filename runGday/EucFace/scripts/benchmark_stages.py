@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Time each stage of a run on synthetic forcing
+
+Writes made up met forcing (and G'DAY output, so the translator can be timed
+without the model) for each run length and times:
+
+    load_met_input_data, load_gday_output, translate_output
+    adjust_param_file, config_overlay, spin_up_pools, run_sim - for each
+    alloc_model
+
+The model stages are skipped if gday isn't installed and a stage that falls
+over is reported as failed rather than stopping the rest. Everything goes to
+a JSON report, e.g.
+
+    python benchmark_stages.py ../outputs/benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+import translate_GDAY_output_to_EUCFACE_format as tr
+
+try:
+    from gday import gday as model
+    from gday import adjust_gday_param_file as ad
+    from gday._version import __version__ as git_revision
+except ImportError:
+    model = None
+    git_revision = None
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (14.12.2014)"
+__email__   = "mdekauwe@gmail.com"
+
+YEARS = [10, 50, 260]
+ALLOC_MODELS = ["FIXED", "ALLOMETRIC", "MAXIMIZEGPP", "MAXIMIZEWOOD"]
+MET_VARS = ["rain", "par", "tair", "tsoil", "vpd_avg", "co2", "ndep"]
+
+def year_doy(nyears, start_year=1750):
+    """ year and doy columns, with leap years """
+    years = np.arange(start_year, start_year + nyears)
+    ndays = 365 + ((years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0)))
+    year = np.repeat(years, ndays)
+    doy = np.concatenate([np.arange(1, n + 1) for n in ndays])
+
+    return year, doy
+
+def write_met_file(fname, nyears, start_year=1750, seed=0):
+    """ Met forcing laid out like the site files: four comment lines then a
+    commented header """
+    rng = np.random.RandomState(seed)
+    (year, doy) = year_doy(nyears, start_year)
+    season = np.cos(2.0 * np.pi * (doy - 15) / 365.25)
+    n = len(year)
+    met = {"rain": rng.exponential(2.5, n) * (rng.rand(n) < 0.4),
+           "par": np.clip(3E7 + 1.5E7 * season + rng.normal(0, 5E6, n),
+                          1E6, None),
+           "tair": 17.0 + 6.0 * season + rng.normal(0, 2.5, n),
+           "co2": np.linspace(280.0, 390.0, n),
+           "ndep": np.repeat(0.002 / 365.25, n)}
+    met["tsoil"] = 0.8 * met["tair"] + 3.0
+    met["vpd_avg"] = np.clip(1.0 + 0.6 * season + rng.normal(0, 0.3, n),
+                             0.05, None)
+
+    with open(fname, "w") as f:
+        f.write("# Synthetic met forcing for benchmarking\n")
+        f.write("# %d years from %d\n" % (nyears, start_year))
+        f.write("# Created by benchmark_stages.py\n")
+        f.write("#\n")
+        f.write("#year,doy,%s\n" % ",".join(MET_VARS))
+        np.savetxt(f, np.column_stack([year, doy] + [met[v] for v in MET_VARS]),
+                   fmt=["%d", "%d"] + ["%.6g"] * len(MET_VARS), delimiter=",")
+
+def write_gday_output(fname, nyears, start_year=1750, seed=0):
+    """ Daily G'DAY output with every column the translator reads """
+    rng = np.random.RandomState(seed)
+    (year, doy) = year_doy(nyears, start_year)
+    columns = [c for c in tr.gday_columns_needed() if c not in ["year", "doy"]]
+    data = rng.uniform(0.01, 5.0, (len(year), len(columns)))
+
+    with open(fname, "w") as f:
+        f.write("#Git revision code benchmark\n")
+        f.write("#year,doy,%s\n" % ",".join(columns))
+        np.savetxt(f, np.column_stack([year, doy, data]),
+                   fmt=["%d", "%d"] + ["%.6f"] * len(columns), delimiter=",")
+
+def timed(func, repeat=1):
+    """ Best of repeat calls: wall time, CPU time and an error if it raised """
+    best = None
+    for i in xrange(repeat):
+        (t0, c0) = (time.time(), sum(os.times()[:2]))
+        try:
+            func()
+        except Exception as e:
+            return {"status": "failed", "error": "%s: %s" % \
+                                                 (type(e).__name__, e)}
+        (wall, cpu) = (time.time() - t0, sum(os.times()[:2]) - c0)
+        if best is None or wall < best["wall_s"]:
+            best = {"status": "ok", "wall_s": wall, "cpu_s": cpu}
+
+    return best
+
+def benchmark(nyears, work_dir, base_cfg_fname, alloc_models=ALLOC_MODELS,
+              repeat=3):
+    """ Time every stage for one run length, returns a list of results """
+    met_fname = os.path.join(work_dir, "met_%d_yrs.csv" % nyears)
+    gday_fname = os.path.join(work_dir, "gday_%d_yrs.out" % nyears)
+    write_met_file(met_fname, nyears)
+    write_gday_output(gday_fname, nyears)
+    ndays = len(year_doy(nyears)[0])
+
+    results = []
+    def record(stage, result, alloc_model=None):
+        result.update({"stage": stage, "nyears": nyears, "ndays": ndays,
+                       "alloc_model": alloc_model})
+        if result["status"] == "ok":
+            result["days_per_s"] = ndays / max(result["wall_s"], 1E-9)
+        results.append(result)
+
+    record("load_met_input_data",
+           timed(lambda: tr.load_met_input_data(met_fname), repeat))
+    record("load_gday_output",
+           timed(lambda: tr.load_gday_output(gday_fname), repeat))
+    record("translate_output",
+           timed(lambda: tr.translate_output(gday_fname, met_fname,
+                            ofname=os.path.join(work_dir, "nceas.csv")),
+                 repeat))
+
+    for alloc_model in alloc_models:
+        if model is None:
+            for stage in ["adjust_param_file", "config_overlay",
+                          "spin_up_pools", "run_sim"]:
+                record(stage, {"status": "skipped",
+                               "error": "gday not installed"}, alloc_model)
+            continue
+        import gday_config as gc
+
+        cfg_fname = os.path.join(work_dir, "%s.cfg" % alloc_model)
+        replace_dict = {"git_hash": str(git_revision),
+                        "cfg_fname": cfg_fname,
+                        "met_fname": met_fname,
+                        "out_fname": os.path.join(work_dir,
+                                                  "%s.out" % alloc_model),
+                        "out_param_fname": os.path.join(work_dir,
+                                                  "%s_end.cfg" % alloc_model),
+                        "alloc_model": alloc_model,
+                        "print_options": "daily"}
+        def adjust():
+            shutil.copy(base_cfg_fname, cfg_fname)
+            ad.adjust_param_file(cfg_fname, replace_dict)
+        record("adjust_param_file", timed(adjust, repeat), alloc_model)
+        record("config_overlay",
+               timed(lambda: gc.GdayConfig.read(base_cfg_fname).overlay(
+                                                    replace_dict), repeat),
+               alloc_model)
+        record("spin_up_pools",
+               timed(lambda: model.Gday(cfg_fname, spin_up=True).\
+                                                        spin_up_pools()),
+               alloc_model)
+        adjust()
+        record("run_sim", timed(lambda: model.Gday(cfg_fname).run_sim()),
+               alloc_model)
+
+    return results
+
+def main(report_fname, years=YEARS, alloc_models=ALLOC_MODELS,
+         base_cfg_fname=None, repeat=3):
+    """ Benchmark every run length and write the JSON report
+
+    Parameters:
+    ----------
+    report_fname : string
+        where the report goes
+    years : list
+        run lengths in years
+    alloc_models : list
+        allocation models for the model stages
+    base_cfg_fname : string
+        cfg the model stages start from, default the EucFACE industrial cfg
+    repeat : int
+        the fast stages are run this many times and the best kept
+    """
+    if base_cfg_fname is None:
+        base_cfg_fname = os.path.join(os.path.dirname(os.path.dirname(
+                                      os.path.abspath(__file__))), "params",
+                                      "FACE_EUC_model_indust.cfg")
+    # gday_config lives with the site independent scripts
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
+                    os.path.dirname(os.path.abspath(__file__)))), "scripts"))
+    
+    work_dir = tempfile.mkdtemp(prefix="gday_benchmark_")
+    try:
+        results = []
+        for nyears in years:
+            results.extend(benchmark(nyears, work_dir, base_cfg_fname,
+                                     alloc_models, repeat))
+    finally:
+        shutil.rmtree(work_dir)
+
+    report = {"git_revision": git_revision,
+              "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "host": platform.node(),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "pandas": pd.__version__,
+              "results": results}
+    with open(report_fname, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    return report
+
+if __name__ == "__main__":
+
+    report_fname = sys.argv[1] if len(sys.argv) > 1 else "benchmark.json"
+    report = main(report_fname)
+    for r in report["results"]:
+        print "%-20s %4d yrs %-13s %s" % (r["stage"], r["nyears"],
+                                          r["alloc_model"] or "",
+                                          "%.3f s" % r["wall_s"]
+                                          if r["status"] == "ok"
+                                          else r["status"])
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Cache of parsed met forcing
+
+The scenario runs keep re-parsing the same handful of met files. The first
+load stores the unit converted columns as a (variable, day) float64 .npy in
+cache_dir, keyed on the met file's path, mtime and size, and every later load
+just memory maps it. Parallel workers mapping the same file share one copy in
+the page cache.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from file_utils import ensure_dir, atomic_write
+
+def cache_key(fname):
+    """ Changes whenever the met file is touched, moved or resized """
+    st = os.stat(fname)
+    key = "%s|%r|%d" % (os.path.abspath(fname), st.st_mtime, st.st_size)
+
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def load(fname, cache_dir, loader):
+    """ Load the met columns for fname, parsing it with loader on a miss
+
+    Parameters:
+    ----------
+    fname : string
+        met forcing file
+    cache_dir : string
+        where the cached arrays live
+    loader : function
+        loader(fname) -> (columns, days), columns a dictionary of converted
+        met variables and days the date of each row as days since 1970
+
+    Returns:
+    --------
+    columns : dictionary
+        read-only memory mapped view of each met variable
+    days : array
+        days since 1970 for each row
+    """
+    key = cache_key(fname)
+    npy_fname = os.path.join(cache_dir, key + ".npy")
+    json_fname = os.path.join(cache_dir, key + ".json")
+
+    # the header is written last, so if it is there the array is complete
+    if not os.path.exists(json_fname):
+        (columns, days) = loader(fname)
+        store(cache_dir, npy_fname, json_fname, fname, columns, days)
+
+    with open(json_fname) as f:
+        names = json.load(f)["names"]
+    data = np.load(npy_fname, mmap_mode="r")
+    columns = dict((k, data[i]) for (i, k) in enumerate(names))
+    days = columns.pop("_days")
+
+    return columns, days
+
+def store(cache_dir, npy_fname, json_fname, fname, columns, days):
+    ensure_dir(cache_dir)
+
+    names = sorted(columns.keys()) + ["_days"]
+    data = np.vstack([np.asarray(columns[k], dtype=np.float64)
+                      for k in names[:-1]] +
+                     [np.asarray(days, dtype=np.float64)])
+
+    with atomic_write(npy_fname, "wb", suffix=".npy") as f:
+        np.save(f, data)
+    with atomic_write(json_fname, suffix=".json") as f:
+        json.dump({"names": names, "source": os.path.abspath(fname)}, f)
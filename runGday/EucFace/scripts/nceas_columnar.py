@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Binary columnar copy of the NCEAS output
+
+Alongside D1GDAY<site><model><TREATMENT><EXP>.csv we can write
+D1GDAY<...>.npy, a (variable, day) float64 array with each variable stored
+contiguously, and D1GDAY<...>.json holding the variable names, long names,
+units and git revision. Loading a variable is then a memory map of one row
+of the array, not a parse of 90 columns of text.
+"""
+import os
+import json
+import tempfile
+import numpy as np
+from file_utils import atomic_fname, atomic_write
+
+# rows copied at a time when transposing to the column-major file
+COPY_ROWS = 65536
+
+# compressed csv extensions, stripped along with the .csv
+COMPRESSED_EXTS = [".gz", ".zst", ".zstd"]
+
+def columnar_fnames(fname):
+    """ (array, header) filenames for the NCEAS csv fname, the same whether
+    or not the csv is compressed """
+    (base, ext) = os.path.splitext(fname)
+    if ext.lower() in COMPRESSED_EXTS:
+        base = os.path.splitext(base)[0]
+
+    return base + ".npy", base + ".json"
+
+class ColumnarWriter(object):
+    """ Collect the NCEAS rows a chunk at a time and turn them into the
+    columnar file on close.
+
+    Rows are appended to a raw scratch file as they arrive, so memory stays
+    flat, and are transposed into the final array in blocks once we know how
+    many days there are.
+    """
+    def __init__(self, fname, variable_names, variable, units, git_ver):
+        self.fname = fname
+        self.header = {"variable_names": list(variable_names),
+                       "variable": list(variable),
+                       "units": list(units),
+                       "git_revision": git_ver.strip()}
+        self.ncols = len(variable_names)
+        self.nrows = 0
+        (fd, self.rows_fname) = tempfile.mkstemp(
+                                        dir=os.path.dirname(os.path.abspath(fname)),
+                                        suffix=".rows")
+        self.f = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        """ data is a (day, variable) chunk of the NCEAS rows """
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        assert data.shape[1] == self.ncols
+        data.tofile(self.f)
+        self.nrows += data.shape[0]
+
+    def discard(self):
+        """ Give up, e.g. the translation failed, leaving nothing behind """
+        self.f.close()
+        if os.path.exists(self.rows_fname):
+            os.remove(self.rows_fname)
+
+    def close(self):
+        self.f.close()
+        (npy_fname, json_fname) = columnar_fnames(self.fname)
+        try:
+            with atomic_fname(npy_fname, suffix=".npy") as tmp_fname:
+                out = np.lib.format.open_memmap(tmp_fname, mode="w+",
+                                                dtype=np.float64,
+                                                shape=(self.ncols, self.nrows))
+                if self.nrows > 0:
+                    rows = np.memmap(self.rows_fname, dtype=np.float64, 
+                                     mode="r", shape=(self.nrows, self.ncols))
+                    for i in range(0, self.nrows, COPY_ROWS):
+                        out[:,i:i+COPY_ROWS] = rows[i:i+COPY_ROWS].T
+                    del rows
+                out.flush()
+                del out
+        finally:
+            os.remove(self.rows_fname)
+
+        self.header["nrows"] = self.nrows
+        with atomic_write(json_fname, suffix=".json") as f:
+            json.dump(self.header, f, indent=1)
+
+def load_columnar_header(fname):
+    """ names, long names, units, git revision and number of days """
+    (npy_fname, json_fname) = columnar_fnames(fname)
+    with open(json_fname) as f:
+        header = json.load(f)
+
+    return header
+
+def load_columnar(fname, variables=None):
+    """ Load NCEAS variables from the columnar copy of fname
+
+    Parameters:
+    ----------
+    fname : string
+        NCEAS csv filename (or either of the columnar files)
+    variables : list
+        NCEAS variable names, e.g. ["GPP", "NPP"], None gives everything
+
+    Returns:
+    --------
+    columns : dictionary
+        read-only memory mapped view of each variable, nothing is read from
+        disk until it is used
+    """
+    header = load_columnar_header(fname)
+    data = np.load(columnar_fnames(fname)[0], mmap_mode="r")
+    names = header["variable_names"]
+    if variables is None:
+        variables = names
+
+    return dict((k, data[names.index(k)]) for k in variables)
@@ -5,42 +5,122 @@
 Match the NCEAS format and while we are at it carry out unit conversion so that 
 we matched required standard. Data should be comma-delimited
 """
-import shutil
 import os
+import time
+import itertools
+import contextlib
 import numpy as np
 import csv
 import sys
 import matplotlib.pyplot as plt
-import datetime as dt
 import pandas as pd
-from cStringIO import StringIO
+
+# the shared helpers in runGday/scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__)))), "scripts"))
+from compressed_io import compression, open_stream
+from file_utils import atomic_fname
+import nceas_columnar as nc
+import met_cache as mc
 
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (06.04.2011)"
 __email__   = "mdekauwe@gmail.com"
 
-def date_converter(*args): 
-    return dt.datetime.strptime(str(int(float(args[0]))) + " " +\
-                                str(int(float(args[1]))), '%Y %j')
+# number of days translated at a time, keeps memory flat however long the run
+CHUNK_SIZE = 3653
+
+def year_doy_to_datetime(year, doy):
+    """ Convert whole columns of year and day of year to dates in one go, 
+    strptime on every row was a big chunk of the load time """
+    year = np.asarray(year, dtype=np.float64).astype(np.int64)
+    doy = np.asarray(doy, dtype=np.float64).astype(np.int64)
+    dates = ((year - 1970).astype("datetime64[Y]").astype("datetime64[D]") +
+             (doy - 1).astype("timedelta64[D]"))
+    
+    return pd.DatetimeIndex(dates, name="year_doy")
+
+def translate_output(infname, met_fname, outdir=None, 
+                     chunk_size=CHUNK_SIZE, columnar=False, envir=None, 
+                     ofname=None, variables=None, profiler=None, done=None,
+                     abort=None, output_profile=None):
+    """ The output is written to a uniquely named temp file in outdir, by 
+    default the directory of the output (outdir must be on the same 
+    filesystem), and renamed into place in one step, so any number of 
+    translations can run at once. 
+    The files are read, converted and written chunk_size days at a time so we
+    never hold the whole run in memory. 
+    
+    With columnar we also write a binary copy next to the output, see 
+    nceas_columnar.load_columnar.
+    
+    The driver can hand over met forcing it has already loaded (the dict from
+    load_met_input_data) as envir, and infname can be a pipe the model is 
+    writing to, in which case the NCEAS output goes to ofname. By default
+    infname is overwritten. Any of the files can be gzip or zstd compressed,
+    see open_stream, e.g. ofname="D1GDAYEUCFIXEDAMBAVG.csv.gz".
+    
+    variables limits the G'DAY conversion to those NCEAS variables, the rest
+    are written as UNDEF. An output_profile (see OUTPUT_PROFILES) goes 
+    further, only its variables are read, converted and written at all.
+    
+    profiler (see runGday/scripts/run_profiler.py) gets the time spent 
+    reading and converting and the time spent writing, summed over chunks. 
+    
+    A file which is already in NCEAS format is refused, rather than parsed 
+    as G'DAY output. 
+    
+    With done (an Event) infname is followed as the model writes it and each
+    chunk is translated as soon as its rows are complete, the translation 
+    finishes once done is set and the rest of the file has been read. The 
+    model must start from an empty (or no) infname. Setting abort instead 
+    gives up, leaving ofname alone. infname can't be compressed then. """
+    if done is not None and compression(infname) is not None:
+        raise ValueError("can't follow the compressed %s" % infname)
+    if done is None and os.path.isfile(infname) and is_translated(infname):
+        raise ValueError("%s is already in NCEAS format" % infname)
+    stage = profiler.stage if profiler is not None else unprofiled_stage
+    columns = profile_variables(output_profile)
+    if columns is not None and variables is None:
+        variables = columns
+    
+    # met stuff, i.e. the stuff needed for NCEAS output that G'day 
+    # does not output. We only write the numbers so don't bother with dates
+    if columns is not None and not set(columns) & set(MET_VARIABLES):
+        envir_chunks = itertools.repeat({})
+    elif envir is None:
+        envir_chunks = iter_met_input_data(met_fname, chunk_size, 
+                                           parse_dates=False)
+    else:
+        envir_chunks = iter_dict_chunks(envir, chunk_size)
+    
+    # the rest of the g'day output
+    if variables is not None:
+        variables = ['YEAR', 'DOY'] + list(variables)
+    (gday_chunks, git_ver) = iter_gday_output(infname, chunk_size, 
+                                              parse_dates=False, 
+                                              variables=variables, done=done,
+                                              abort=abort)
+    
+    if ofname is None:
+        ofname = infname
+    with atomic_fname(ofname, suffix=".nceas", dirname=outdir) as tmp_fname:
+        with contextlib.closing(open_stream(tmp_fname, "w", like=ofname)) as f:
+            write_nceas(f, gday_chunks, envir_chunks, git_ver, ofname, 
+                        columnar, stage, columns)
 
-def translate_output(infname, met_fname):
-    outdir = "../outputs"
+def write_nceas(f, gday_chunks, envir_chunks, git_ver, ofname, columnar, 
+                stage, columns=None):
+    """ Convert the chunks and write them to the open file f, only the 
+    columns (NCEAS variable names) given, in the usual order """
     UNDEF = -9999.
     units = setup_units()
     variable, variable_names = setup_varnames()
-    
-    # load met stuff, i.e. the stuff needed for NCEAS output that G'day 
-    # does not output
-    envir = load_met_input_data(met_fname)
-    
-    # load the rest of the g'day output
-    (gday, git_ver) = load_gday_output(infname)
-
-    # merge dictionaries to ease output
-    data_dict = dict(envir, **gday)
-    
-    ofname = os.path.join(outdir, "temp.nceas")
-    f = open(ofname, "w")
+    if columns is not None:
+        keep = [j for (j, k) in enumerate(variable_names) if k in columns]
+        units = [units[j] for j in keep]
+        variable = [variable[j] for j in keep]
+        variable_names = [variable_names[j] for j in keep]
     f.write("%s," % (git_ver))
     
     # write output in csv format
@@ -50,59 +130,248 @@ def translate_output(infname, met_fname):
     writer.writerow(variable)
     writer.writerow(units)
     writer.writerow(variable_names)
-    for i in xrange(len(gday['DOY'])):
-        writer.writerow([("%.8f" % (float(data_dict[k][i])) \
-                         if data_dict.has_key(k) else UNDEF)
-                         for k in variable_names])
+    if columnar:
+        binary = nc.ColumnarWriter(ofname, variable_names, variable, units, 
+                                   git_ver)
+    try:
+        while True:
+            with stage("translate_read") as counts:
+                gday = next(gday_chunks, None)
+                if gday is not None:
+                    envir = next(envir_chunks)
+                    counts["rows"] += len(gday['DOY'])
+            if gday is None:
+                break
+        
+            with stage("translate_write") as counts:
+                # merge dictionaries to ease output
+                data_dict = dict(envir, **gday)
+                (data, fmt) = stack_nceas_rows(data_dict, variable_names, 
+                                               len(gday['DOY']), UNDEF)
+            
+                # csv.excel terminates rows with \r\n
+                np.savetxt(f, data, fmt=fmt, delimiter=",", newline="\r\n")
+                if columnar:
+                    binary.write(data)
+                counts["rows"] += len(data)
+                counts["days"] += len(data)
+    except:
+        # don't leave the columnar scratch file behind
+        if columnar:
+            binary.discard()
+        raise
+    if columnar:
+        binary.close()
+    
+def is_translated(fname):
+    """ After the git revision NCEAS output has the long variable names, 
+    G'DAY output has its own #year,doy,... header """
+    with contextlib.closing(open_stream(fname)) as f:
+        head = f.readline() + f.readline()
+    
+    return ",Year,Day of the year," in head
+
+@contextlib.contextmanager
+def unprofiled_stage(name):
+    """ Stand in for RunProfiler.stage when nobody is profiling """
+    yield {"rows": 0, "days": 0}
+
+def stack_nceas_rows(data_dict, variable_names, nrows, UNDEF):
+    """ Stack everything into one array so all the rows can be written in one
+    go, rather than formatting cell by cell.
+    
+    The returned per-column formats give byte-for-byte what the old 
+    csv.writer loop produced: variables we have are written "%.8f", missing 
+    ones as the bare UNDEF value. 
+    """
+    data = np.empty((nrows, len(variable_names)))
+    data.fill(UNDEF)
+    fmt = []
+    for (j, k) in enumerate(variable_names):
+        if k in data_dict:
+            data[:,j] = np.asarray(data_dict[k], dtype=np.float64)[:nrows]
+            fmt.append("%.8f")
+        else:
+            fmt.append("%s")
+    
+    return data, fmt
+    
+class CommentStrippedFile(object):
+    """ Read-only file object which removes the comments from each line as
+    pandas asks for it, rather than copying the whole file into a buffer. 
+    fname can be compressed, see open_stream, f is the already open fname, 
+    e.g. a TailFile """
+    def __init__(self, fname, f=None):
+        self.f = open_stream(fname) if f is None else f
+        self.pending = []
+        self.npending = 0
+    
+    def readline(self):
+        line = self.f.readline()
+        if '#' in line:
+            line = line.replace("#", "").lstrip(' ')
+        
+        return line
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = "".join(self.pending) + "".join(iter(self.readline, ""))
+            self.pending = []
+            self.npending = 0
+            return data
+        
+        while self.npending < size:
+            line = self.readline()
+            if not line:
+                break
+            self.pending.append(line)
+            self.npending += len(line)
+        data = "".join(self.pending)
+        self.pending = [data[size:]]
+        self.npending = len(self.pending[0])
+        
+        return data[:size]
     
-    # Need to replace the temp file with the infname which is actually
-    # the filename we want to use
-    shutil.move(ofname, infname)
+    def __iter__(self):
+        return iter(self.readline, "")
     
+    def close(self):
+        self.f.close()
+
+class TailFile(object):
+    """ Follow a file another process is still writing, readline only hands
+    back whole lines and waits (poll seconds at a time) for the rest. Once 
+    done is set whatever is left is read and then we are at the end. If 
+    abort is set first readline raises IOError """
+    def __init__(self, fname, done, abort=None, poll=0.01):
+        self.fname = fname
+        self.done = done
+        self.abort = abort
+        self.poll = poll
+        self.fd = None
+        self.buf = ""
+    
+    def read_more(self):
+        """ Anything new, "" if nothing has been written since last time """
+        if self.fd is None:
+            try:
+                self.fd = os.open(self.fname, os.O_RDONLY)
+            except OSError:
+                return ""
+        
+        return os.read(self.fd, 1 << 16)
+    
+    def readline(self):
+        while True:
+            i = self.buf.find("\n")
+            if i >= 0:
+                (line, self.buf) = (self.buf[:i+1], self.buf[i+1:])
+                return line
+            
+            if self.abort is not None and self.abort.is_set():
+                raise IOError("gave up following %s" % self.fname)
+            finished = self.done.is_set()
+            data = self.read_more()
+            if data:
+                self.buf += data
+            elif finished:
+                # everything written before done was set has been read
+                (line, self.buf) = (self.buf, "")
+                return line
+            else:
+                time.sleep(self.poll)
+    
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
 def remove_comments_from_header(fname):
     """ I have made files with comments which means the headings can't be 
     parsed to get dictionary headers for pandas! Solution is to remove these
-    comments first """
-    s = StringIO()
-    with open(fname) as f:
-        for line in f:
-            if '#' in line:
-                line = line.replace("#", "").lstrip(' ')
-            s.write(line)
-    s.seek(0) # "rewind" to the beginning of the StringIO object
-    
-    return s
+    comments first, as the file is read """
+    
+    return CommentStrippedFile(fname)
 
-def remove_comments_from_header_and_get_git_rev(fname):
+def remove_comments_from_header_and_get_git_rev(fname, done=None, 
+                                                abort=None):
     """ I have made files with comments which means the headings can't be 
     parsed to get dictionary headers for pandas! Solution is to remove these
-    comments first """
-    s = StringIO()
-    with open(fname) as f:
-        line_counter = 0
-        for line in f:
-            if line_counter == 0:
-                git_ver = line.rstrip(' ')
-            if '#' in line:
-                line = line.replace("#", "").lstrip(' ')
-            s.write(line)
-            line_counter += 1
-    s.seek(0) # "rewind" to the beginning of the StringIO object
+    comments first, as the file is read. 
+    
+    The git revision line is consumed, so the file starts at the headings,
+    that way fname is only opened once and can be a pipe. With done fname is
+    followed as it is written, see TailFile """
+    if done is None:
+        s = CommentStrippedFile(fname)
+    else:
+        s = CommentStrippedFile(fname, TailFile(fname, done, abort))
+    git_ver = s.f.readline().rstrip(' ')
     
     return s, git_ver
 
-def load_met_input_data(fname):
+def iter_chunks(s, chunk_size, convert, parse_dates=True, **kwargs):
+    """ Parse the stripped file s with pandas, chunk_size rows at a time 
+    (all of it if None) and yield each chunk after convert. With parse_dates
+    each chunk is indexed by the date built from its first two (year, doy)
+    columns """
+    try:
+        if chunk_size is None:
+            chunks = [pd.read_csv(s, **kwargs)]
+        else:
+            chunks = pd.read_csv(s, chunksize=chunk_size, **kwargs)
+        for chunk in chunks:
+            if parse_dates:
+                chunk.index = year_doy_to_datetime(chunk.iloc[:,0], 
+                                                   chunk.iloc[:,1])
+            yield convert(chunk)
+    finally:
+        s.close()
+
+def iter_dict_chunks(data, chunk_size):
+    """ Slice a dictionary of already loaded columns into chunk_size rows """
+    nrows = len(data.values()[0])
+    if chunk_size is None:
+        chunk_size = max(nrows, 1)
+    for i in xrange(0, nrows, chunk_size):
+        yield dict((k, np.asarray(v)[i:i+chunk_size]) 
+                   for (k, v) in data.iteritems())
+
+def load_met_input_data(fname, parse_dates=True, cache_dir=None):
+    """ With a cache_dir the converted columns are memory mapped from the met
+    cache (built on first use), see met_cache.py """
+    if cache_dir is None:
+        return next(iter_met_input_data(fname, parse_dates=parse_dates))
+    
+    (envir, days) = mc.load(fname, cache_dir, parse_met_for_cache)
+    if parse_dates:
+        index = pd.DatetimeIndex(days.astype(np.int64).astype("datetime64[D]"),
+                                 name="year_doy")
+        envir = dict((k, pd.Series(v, index=index)) 
+                     for (k, v) in envir.iteritems())
+    
+    return envir
+
+def parse_met_for_cache(fname):
+    envir = load_met_input_data(fname)
+    dates = envir.values()[0].index.values
+    days = dates.astype("datetime64[D]").astype(np.int64)
+    
+    return envir, days
+
+def iter_met_input_data(fname, chunk_size=None, parse_dates=True):
+    s = remove_comments_from_header(fname)
+    
+    return iter_chunks(s, chunk_size, convert_met_input_data, 
+                       parse_dates=parse_dates, skiprows=4, sep=",")
+
+def convert_met_input_data(met_data):
     MJ_TO_MOL = 4.6
     SW_TO_PAR = 0.48
     DAYS_TO_HRS = 24.0
     UMOL_TO_MOL = 1E-6
     tonnes_per_ha_to_g_m2 = 100.0
     
-    s = remove_comments_from_header(fname)
-    met_data = pd.read_csv(s, parse_dates=[[0,1]], skiprows=4, index_col=0, 
-                           sep=",", keep_date_col=True, 
-                           date_parser=date_converter)
-    
     precip = met_data["rain"]
     #par = met_data[:,1] * MJ_TO_MOL * SW_TO_PAR
     par = met_data["par"] * UMOL_TO_MOL
@@ -115,151 +384,224 @@ def load_met_input_data(fname):
     return {'CO2': co2, 'PPT':precip, 'PAR':par, 'AT':air_temp, 'ST':soil_temp, 
             'VPD':vpd, 'NDEP':ndep}
     
-def load_gday_output(fname):
-    SW_RAD_TO_PAR = 2.3
-    UNDEF = -9999.
-    tonnes_per_ha_to_g_m2 = 100
-    yr_to_day = 365.25
-    
-    (s, git_ver) = remove_comments_from_header_and_get_git_rev(fname)
-    out = pd.read_csv(s, parse_dates=[[0,1]], skiprows=1, index_col=0, 
-                      sep=",", keep_date_col=True, date_parser=date_converter)
+def load_gday_output(fname, parse_dates=True, variables=None):
+    """ variables limits the work to the NCEAS variables we want, e.g. 
+    ["GPP", "NPP"], default is all of them """
+    (gday_chunks, git_ver) = iter_gday_output(fname, parse_dates=parse_dates,
+                                              variables=variables)
     
-    year = out["year"]
-    doy = out["doy"]
+    return next(gday_chunks), git_ver
+
+def iter_gday_output(fname, chunk_size=None, parse_dates=True, 
+                     variables=None, done=None, abort=None):
+    (s, git_ver) = remove_comments_from_header_and_get_git_rev(fname, done,
+                                                               abort)
+    
+    # only parse the columns the variables need
+    usecols = ["year", "doy"] + [c for c in gday_columns_needed(variables) 
+                                 if c not in ["year", "doy"]]
+    convert = lambda out: convert_gday_output(out, variables)
+    gday_chunks = iter_chunks(s, chunk_size, convert, parse_dates=parse_dates,
+                              sep=",", usecols=usecols)
+    
+    return gday_chunks, git_ver
+
+# G'DAY output -> NCEAS variables. Each NCEAS variable is the sum of the listed
+# G'DAY columns, each multiplied by the scale factor first
+TONNES_PER_HA_TO_G_M2 = 100.0
+UMOL_TO_MOL = 1E-6
+MOL_TO_MJ = 1.0 / 4.6
+GDAY_TO_NCEAS = [
+    # name,     G'DAY columns,                              scale factor
+    ('YEAR',    ['year'],                                   1.0),
+    ('DOY',     ['doy'],                                    1.0),
     
     # state outputs
-    pawater_root = out["pawater_root"] 
-    shoot = out["shoot"] * tonnes_per_ha_to_g_m2
-    stem = out["stem"] * tonnes_per_ha_to_g_m2
-    branch = out["branch"] * tonnes_per_ha_to_g_m2
-    fine_root = out["root"] * tonnes_per_ha_to_g_m2
-    coarse_root = out["croot"] * tonnes_per_ha_to_g_m2
-    coarse_rootn = out["crootn"] * tonnes_per_ha_to_g_m2
-    litterc = out["litterc"] * tonnes_per_ha_to_g_m2
-    littercag = out["littercag"] * tonnes_per_ha_to_g_m2
-    littercbg = out["littercbg"] * tonnes_per_ha_to_g_m2
-    soilc = out["soilc"] * tonnes_per_ha_to_g_m2
-    lai = out["lai"]
-    shootn = out["shootn"] * tonnes_per_ha_to_g_m2
-    stemn = out["stemn"] * tonnes_per_ha_to_g_m2
-    branchn = out["branchn"] * tonnes_per_ha_to_g_m2
-    rootn = out["rootn"] * tonnes_per_ha_to_g_m2
-    crootn = out["crootn"] * tonnes_per_ha_to_g_m2
-    litternag = out["litternag"] * tonnes_per_ha_to_g_m2
-    litternbg = out["litternbg"] * tonnes_per_ha_to_g_m2
-    nsoil = out["soiln"] * tonnes_per_ha_to_g_m2
-    inorgn = out["inorgn"] * tonnes_per_ha_to_g_m2
-    tnc = out["cstore"] * tonnes_per_ha_to_g_m2
-    nstorage = out["nstore"] * tonnes_per_ha_to_g_m2
-    activesoiln = out["activesoiln"] * tonnes_per_ha_to_g_m2
-    slowsoiln = out["slowsoiln"] * tonnes_per_ha_to_g_m2
-    passivesoiln = out["passivesoiln"] * tonnes_per_ha_to_g_m2
-    npoolo = activesoiln + slowsoiln + passivesoiln
-    
-    # fluxes outputs
-    beta = out["wtfac_root"] 
-    nep = out["nep"] * tonnes_per_ha_to_g_m2
-    gpp = out["gpp"] * tonnes_per_ha_to_g_m2
-    npp = out["npp"] * tonnes_per_ha_to_g_m2
-    rh = out["hetero_resp"] * tonnes_per_ha_to_g_m2
-    ra = out["auto_resp"] * tonnes_per_ha_to_g_m2
-    et = out["et"] # mm of water' are same value as kg/m2
-    trans = out["transpiration"] # mm of water' are same value as kg/m2
-    soil_evap = out["soil_evap"] # mm of water' are same value as kg/m2
-    can_evap = out["interception"] # mm of water' are same value as kg/m2
-    runoff = out["runoff"] # mm of water' are same value as kg/m2
-    gl = out["cpleaf"] * tonnes_per_ha_to_g_m2
-    # gw summed from cpstem and cpbranch below
-    cpstem = out["cpstem"] * tonnes_per_ha_to_g_m2
-    cpbranch = out["cpbranch"] * tonnes_per_ha_to_g_m2
-    gr = out["cproot"] * tonnes_per_ha_to_g_m2
-    gcr = out["cpcroot"] * tonnes_per_ha_to_g_m2
-    deadleaves = out["deadleaves"] * tonnes_per_ha_to_g_m2
-    deadroots = out["deadroots"] * tonnes_per_ha_to_g_m2
-    deadcroots = out["deadcroots"] * tonnes_per_ha_to_g_m2
-    deadbranch = out["deadbranch"] * tonnes_per_ha_to_g_m2
-    deadstems = out["deadstems"] * tonnes_per_ha_to_g_m2
-    deadleafn = out["deadleafn"] * tonnes_per_ha_to_g_m2
-    deadbranchn = out["deadbranchn"] * tonnes_per_ha_to_g_m2
-    deadstemn = out["deadstemn"] * tonnes_per_ha_to_g_m2
-    deadrootn = out["deadrootn"] * tonnes_per_ha_to_g_m2
-    deadcrootn = out["deadcrootn"] * tonnes_per_ha_to_g_m2
-    nup = out["nuptake"] * tonnes_per_ha_to_g_m2
-    ngross = out["ngross"] * tonnes_per_ha_to_g_m2
-    nmin = out["nmineralisation"] * tonnes_per_ha_to_g_m2
-    npleaf = out["npleaf"] * tonnes_per_ha_to_g_m2
-    nproot = out["nproot"] * tonnes_per_ha_to_g_m2
-    npcroot = out["npcroot"] * tonnes_per_ha_to_g_m2
-    npstemimm = out["npstemimm"] * tonnes_per_ha_to_g_m2
-    npstemmob = out["npstemmob"] * tonnes_per_ha_to_g_m2
-    npbranch = out["npbranch"] * tonnes_per_ha_to_g_m2
-    
-    UMOL_TO_MOL = 1E-6
-    MOL_TO_MJ = 1.0 / 4.6
-    convx = UMOL_TO_MOL * MOL_TO_MJ 
-   
-    apar = out["apar"] * convx
-    gcd = out["gs_mol_m2_sec"]
-    ga = out["ga_mol_m2_sec"]
-    nleach = out["nloss"] * tonnes_per_ha_to_g_m2
-    cfretransn = out["leafretransn"] * tonnes_per_ha_to_g_m2
-    
-    # Misc stuff we don't output
-    drainage = [UNDEF] * len(doy)
-    rleaf = [UNDEF] * len(doy)
-    rwood = [UNDEF] * len(doy)
-    rgrow = [UNDEF] * len(doy)
-    rsoil = [UNDEF] * len(doy)
-    cex = [UNDEF] * len(doy)
-    cvoc = [UNDEF] * len(doy)
-    lh = [UNDEF] * len(doy)
-    sh = [UNDEF] * len(doy)
-    ccoarse_lit = [UNDEF] * len(doy)
-    ndw = [UNDEF] * len(doy)
-    nfix = [UNDEF] * len(doy)
-    nvol = [UNDEF] * len(doy)
-    gb = [UNDEF] * len(doy)
-    grepr = [UNDEF] * len(doy)
-    cwretransn = [UNDEF] * len(doy)
-    ccrretransn = [UNDEF] * len(doy)
-    cfrretransn = [UNDEF] * len(doy)
-    
-    # Misc calcs from fluxes/state
-    lma = shoot / lai
-    ncon = shootn / shoot 
-    recosys = rh + ra
-    cw = stem + branch
-    gw = cpstem + cpbranch
-    cwn = stemn + branchn
-    cwin = deadstems + deadbranch
-    ccrlin = deadcroots
-    cfrlin = deadroots
-    ndeadwood = deadbranchn + deadstemn
-    nwood_growth = npstemimm + npstemmob + npbranch
-    
+    ('SW',      ['pawater_root'],                           1.0),
+    ('CL',      ['shoot'],                                  TONNES_PER_HA_TO_G_M2),
+    ('CW',      ['stem', 'branch'],                         TONNES_PER_HA_TO_G_M2),
+    ('CCR',     ['croot'],                                  TONNES_PER_HA_TO_G_M2),
+    ('CFR',     ['root'],                                   TONNES_PER_HA_TO_G_M2),
+    ('TNC',     ['cstore'],                                 TONNES_PER_HA_TO_G_M2),
+    ('CFLIT',   ['litterc'],                                TONNES_PER_HA_TO_G_M2),
+    ('CFLITA',  ['littercag'],                              TONNES_PER_HA_TO_G_M2),
+    ('CFLITB',  ['littercbg'],                              TONNES_PER_HA_TO_G_M2),
+    ('CSOIL',   ['soilc'],                                  TONNES_PER_HA_TO_G_M2),
+    ('LAI',     ['lai'],                                    1.0),
+    ('NCAN',    ['shootn'],                                 TONNES_PER_HA_TO_G_M2),
+    ('NWOOD',   ['stemn', 'branchn'],                       TONNES_PER_HA_TO_G_M2),
+    ('NCR',     ['crootn'],                                 TONNES_PER_HA_TO_G_M2),
+    ('NFR',     ['rootn'],                                  TONNES_PER_HA_TO_G_M2),
+    ('NSTOR',   ['nstore'],                                 TONNES_PER_HA_TO_G_M2),
+    ('NLIT',    ['litternag'],                              TONNES_PER_HA_TO_G_M2),
+    ('NRLIT',   ['litternbg'],                              TONNES_PER_HA_TO_G_M2),
+    ('NSOIL',   ['soiln'],                                  TONNES_PER_HA_TO_G_M2),
+    ('NPOOLM',  ['inorgn'],                                 TONNES_PER_HA_TO_G_M2),
+    ('NPOOLO',  ['activesoiln', 'slowsoiln', 'passivesoiln'], TONNES_PER_HA_TO_G_M2),
+    
+    # fluxes outputs, water in mm is the same value as kg/m2
+    ('Betad',   ['wtfac_root'],                             1.0),
+    ('NEP',     ['nep'],                                    TONNES_PER_HA_TO_G_M2),
+    ('GPP',     ['gpp'],                                    TONNES_PER_HA_TO_G_M2),
+    ('NPP',     ['npp'],                                    TONNES_PER_HA_TO_G_M2),
+    ('RHET',    ['hetero_resp'],                            TONNES_PER_HA_TO_G_M2),
+    ('RAUTO',   ['auto_resp'],                              TONNES_PER_HA_TO_G_M2),
+    ('RECO',    ['hetero_resp', 'auto_resp'],               TONNES_PER_HA_TO_G_M2),
+    ('ET',      ['et'],                                     1.0),
+    ('T',       ['transpiration'],                          1.0),
+    ('ES',      ['soil_evap'],                              1.0),
+    ('EC',      ['interception'],                           1.0),
+    ('RO',      ['runoff'],                                 1.0),
+    ('GL',      ['cpleaf'],                                 TONNES_PER_HA_TO_G_M2),
+    ('GW',      ['cpstem', 'cpbranch'],                     TONNES_PER_HA_TO_G_M2),
+    ('GR',      ['cproot'],                                 TONNES_PER_HA_TO_G_M2),
+    ('GCR',     ['cpcroot'],                                TONNES_PER_HA_TO_G_M2),
+    ('CLLFALL', ['deadleaves'],                             TONNES_PER_HA_TO_G_M2),
+    ('CFRLIN',  ['deadroots'],                              TONNES_PER_HA_TO_G_M2),
+    ('CCRLIN',  ['deadcroots'],                             TONNES_PER_HA_TO_G_M2),
+    ('CWIN',    ['deadstems', 'deadbranch'],                TONNES_PER_HA_TO_G_M2),
+    ('NLITIN',  ['deadleafn'],                              TONNES_PER_HA_TO_G_M2),
+    ('NWLIN',   ['deadbranchn', 'deadstemn'],               TONNES_PER_HA_TO_G_M2),
+    ('NCRLIN',  ['deadcrootn'],                             TONNES_PER_HA_TO_G_M2),
+    ('NFRLIN',  ['deadrootn'],                              TONNES_PER_HA_TO_G_M2),
+    ('NUP',     ['nuptake'],                                TONNES_PER_HA_TO_G_M2),
+    ('NGMIN',   ['ngross'],                                 TONNES_PER_HA_TO_G_M2),
+    ('NMIN',    ['nmineralisation'],                        TONNES_PER_HA_TO_G_M2),
+    ('NGL',     ['npleaf'],                                 TONNES_PER_HA_TO_G_M2),
+    ('NGR',     ['nproot'],                                 TONNES_PER_HA_TO_G_M2),
+    ('NGCR',    ['npcroot'],                                TONNES_PER_HA_TO_G_M2),
+    ('NGW',     ['npstemimm', 'npstemmob', 'npbranch'],     TONNES_PER_HA_TO_G_M2),
+    ('APARd',   ['apar'],                                   UMOL_TO_MOL * MOL_TO_MJ),
+    ('GCd',     ['gs_mol_m2_sec'],                          1.0),
+    ('GAd',     ['ga_mol_m2_sec'],                          1.0),
+    ('NLEACH',  ['nloss'],                                  TONNES_PER_HA_TO_G_M2),
+    ('NLRETRANS', ['leafretransn'],                         TONNES_PER_HA_TO_G_M2),
+]
+
+# NCEAS variables that come from the met forcing, see convert_met_input_data
+MET_VARIABLES = ['CO2', 'PPT', 'PAR', 'AT', 'ST', 'VPD', 'NDEP']
+
+# NCEAS variables calculated from the ones above, name -> (numerator, 
+# denominator)
+NCEAS_RATIOS = [
+    ('LMA',     'CL',       'LAI'),
+    ('NCON',    'NCAN',     'CL'),
+]
+
+# Misc stuff we don't output
+NCEAS_UNDEF = ['DRAIN', 'RLEAF', 'RWOOD', 'RGROW', 'RSOIL', 'CEX', 'CVOC', 'LE', 
+               'SH', 'CCLITB', 'NDW', 'NFIX', 'NVOL', 'Gbd', 'GREPR', 
+               'NWRETRANS', 'NCRRETRANS', 'NFRRETRANS']
+
+# Named subsets of the NCEAS output, None is everything. allocation is what 
+# plots/cfg.r VarConstruction uses for the allocation comparison
+OUTPUT_PROFILES = {
+    'full':       None,
+    'allocation': ['YEAR', 'DOY', 'NPP', 'GPP', 'GL', 'GW', 'GR'],
+}
+
+def profile_variables(profile=None):
+    """ NCEAS variables in the output profile, None for all of them """
+    if profile is None:
+        return None
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError("unknown output profile %s, try one of %s" % \
+                         (profile, ", ".join(sorted(OUTPUT_PROFILES))))
+    
+    return OUTPUT_PROFILES[profile]
+
+def print_settings(profile, print_keys):
+    """ yes/no for each G'DAY [print] key so that the model only writes the 
+    columns the profile needs. A profile with all the variables, e.g. full,
+    changes nothing, so the cfg's own [print] section stands 
+    
+    Parameters:
+    ----------
+    profile : string
+        see OUTPUT_PROFILES
+    print_keys : list
+        the keys of the cfg's [print] section
+    
+    Returns:
+    --------
+    settings : dictionary
+        {print key: "yes" or "no"}, a replace_dict
+    """
+    variables = profile_variables(profile)
+    if variables is None:
+        return {}
+    needed = set(gday_columns_needed(variables))
+    
+    return dict((key, "yes" if key in needed else "no") for key in print_keys)
+
+def nceas_variables_needed(variables=None):
+    """ The variables asked for plus anything the ratios are made from, all 
+    of them if variables is None """
+    if variables is None:
+        variables = ([name for (name, cols, scale) in GDAY_TO_NCEAS] +
+                     [name for (name, num, den) in NCEAS_RATIOS] + 
+                     NCEAS_UNDEF)
+    variables = set(variables)
+    for (name, num, den) in NCEAS_RATIOS:
+        if name in variables:
+            variables.update([num, den])
+    
+    return variables
+
+def gday_columns_needed(variables=None):
+    """ G'DAY output columns needed to make the NCEAS variables, all of them
+    if variables is None. Anything we don't know about, e.g. the met 
+    variables, is ignored """
+    variables = nceas_variables_needed(variables)
+    columns = []
+    for (name, cols, scale) in GDAY_TO_NCEAS:
+        if name in variables:
+            columns += [c for c in cols if c not in columns]
+    
+    return columns
+
+def convert_gday_output(out, variables=None):
+    """ Unit conversion of G'DAY output to NCEAS variables, driven by the 
+    GDAY_TO_NCEAS/NCEAS_RATIOS/NCEAS_UNDEF tables. All the G'DAY columns we 
+    need are scaled in one array operation, and only the variables asked for
+    (default everything) are made """
+    UNDEF = -9999.
     
-     
-    return {'YEAR':year, 'DOY':doy, 'SW':pawater_root, 
-            'NEP':nep, 'GPP':gpp, 'NPP':npp, 'CEX':cex, 'CVOC':cvoc, 
-            'RECO':recosys, 'RAUTO':ra, 'RLEAF':rleaf, 'RWOOD':rwood, 
-            'RGROW':rgrow, 'RHET':rh, 'RSOIL':rsoil, 'ET':et, 'T':trans,
-            'ES':soil_evap, 'EC':can_evap, 'RO':runoff, 'DRAIN':drainage,
-            'LE':lh, 'SH':sh, 'CL':shoot, 'CW':cw, 'CCR':coarse_root,
-            'CFR':fine_root, 'TNC':tnc, 'CFLIT':litterc, 'CFLITA':littercag,
-            'CFLITB':littercbg, 'CCLITB':ccoarse_lit, 'CSOIL':soilc,
-            'GL':gl, 'GW':gw, 'GCR':gcr, 'GR':gr, 'GREPR':grepr, 'CLLFALL':deadleaves, 
-            'CCRLIN':ccrlin, 'CFRLIN':cfrlin, 'CWIN':cwin, 'LAI':lai, 'LMA':lma, 'NCON':ncon,
-            'NCAN':shootn, 'NWOOD':cwn, 'NCR':coarse_rootn, 'NFR':rootn,
-            'NSTOR':nstorage, 'NLIT':litternag, 'NRLIT':litternbg, 'NDW':ndw, 
-            'NSOIL':nsoil, 'NPOOLM':inorgn, 'NPOOLO':npoolo, 'NFIX':nfix,
-            'NLITIN':deadleafn, 'NWLIN':ndeadwood, 'NCRLIN':deadcrootn, 
-            'NFRLIN':deadrootn, 'NUP':nup,
-            'NGMIN':ngross, 'NMIN':nmin, 'NVOL': nvol, 'NLEACH':nleach, 
-            'NGL':npleaf, 'NGW':nwood_growth, 'NGCR':npcroot, 'NGR':nproot, 
-            'APARd':apar, 'GCd':gcd, 'GAd':ga, 'Gbd':gb, 'Betad':beta,
-            'NLRETRANS':cfretransn, 'NWRETRANS':cwretransn, 
-            'NCRRETRANS':ccrretransn, 'NFRRETRANS':cfrretransn}, git_ver
+    needed = nceas_variables_needed(variables)
+    if variables is None:
+        variables = needed
+    
+    # scale every column we need in one go
+    columns = gday_columns_needed(needed)
+    factors = {}
+    for (name, cols, scale) in GDAY_TO_NCEAS:
+        for c in cols:
+            factors[c] = scale
+    scaled = (out[columns].values.astype(np.float64) * 
+              np.array([factors[c] for c in columns]))
+    scaled = dict((c, scaled[:,j]) for (j, c) in enumerate(columns))
+    
+    converted = {}
+    for (name, cols, scale) in GDAY_TO_NCEAS:
+        if name in needed:
+            total = scaled[cols[0]]
+            for c in cols[1:]:
+                total = total + scaled[c]
+            converted[name] = total
+    for (name, num, den) in NCEAS_RATIOS:
+        if name in needed:
+            converted[name] = converted[num] / converted[den]
+    
+    # one shared read-only array for everything we don't output
+    undef = np.empty(len(out))
+    undef.fill(UNDEF)
+    undef.flags.writeable = False
+    for name in NCEAS_UNDEF:
+        if name in needed:
+            converted[name] = undef
+    
+    return dict((name, pd.Series(converted[name], index=out.index)) 
+                for name in converted if name in variables)
     
 
         
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+EucFACE parameter sweep.
+
+Every member of a Latin hypercube over the allocation/photosynthesis
+parameters is spun up, run through the industrial period and then through the
+amb/ele x avg/var simulations, on a pool of worker processes, e.g.
+
+    python eucface_parameter_sweep.py MAXIMIZEGPP 200 8
+
+runs 200 members for MAXIMIZEGPP on eight cores. Each member gets its own
+experiment_id (FACE_s0042 etc) so none of the cfg, output or scratch files
+are shared. The run mean of a handful of NCEAS variables for each scenario is
+stored against the member's sample id in
+outputs/sweep/FACE_EUC_<alloc_model>_sweep.npz
+"""
+import os
+import sys
+import functools
+import numpy as np
+
+import eucface_spinup_to_equilibrium as spinup
+import eucface_simulations as sims
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (14.12.2014)"
+__email__   = "mdekauwe@gmail.com"
+
+# parameters people were tuning by hand, (lower, upper)
+RANGES = {
+          "c_alloc_fmax": (0.25, 0.5),
+          "c_alloc_fmin": (0.05, 0.25),
+          "c_alloc_rmax": (0.2, 0.5),
+          "c_alloc_rmin": (0.05, 0.2),
+          "targ_sens": (0.25, 1.0),
+          "leafsap0": (3000.0, 5000.0),
+          "leafsap1": (2000.0, 3500.0),
+          "g1": (3.0, 5.0),
+          "vcmaxna": (12.0, 20.0),
+         }
+
+# NCEAS variables summarised for each member
+SUMMARY_VARS = ["GPP", "NPP", "GL", "GW", "GR", "LAI"]
+
+def run_member(sample_id, params, experiment_id, site, alloc_model,
+               treatments, exps):
+    """ Spin-up, industrial and experiment runs for one member of the design
+
+    Returns:
+    --------
+    results : dictionary
+        run mean of each SUMMARY_VARS, keyed <treatment>_<exp>_<variable>
+    """
+    base_dir = os.path.dirname(os.getcwd())
+    sys.path.append(os.path.join(base_dir, "scripts"))
+    sys.path.append(os.path.join(os.path.dirname(base_dir), "scripts"))
+    import nceas_columnar as nc
+
+    member_id = "%s_s%04d" % (experiment_id, sample_id)
+    out_dir = os.path.join(base_dir, "outputs", "sweep", member_id)
+    # repr round trips exactly, so the model runs the values the .npz stores
+    params = dict((k, repr(float(v))) for (k, v) in params.items())
+
+    spinup.main(member_id, site, alloc_model=alloc_model,
+                param_overrides=params)
+    indust_cfg_fname = os.path.join(base_dir, "params",
+                                    "%s_%s_%s_model_indust.cfg" % \
+                                    (member_id, site, alloc_model))
+    results = {}
+    for treatment in treatments:
+        for exp in exps:
+            out_fname = sims.main(member_id, site, treatment, exp,
+                                  alloc_model=alloc_model,
+                                  param_overrides=params,
+                                  indust_cfg_fname=indust_cfg_fname,
+                                  out_dir=out_dir, columnar=True)
+            data = nc.load_columnar(out_fname, SUMMARY_VARS)
+            for var in SUMMARY_VARS:
+                results["%s_%s_%s" % (treatment, exp, var)] = \
+                                                    float(np.mean(data[var]))
+
+    return results
+
+def main(experiment_id, site, alloc_model, nsamples, nworkers=None, seed=0,
+         ranges=RANGES, treatments=["amb", "ele"], exps=["avg", "var"]):
+
+    base_dir = os.path.dirname(os.getcwd())
+    sys.path.append(os.path.join(os.path.dirname(base_dir), "scripts"))
+    import parameter_sweep as ps
+    import file_utils as fu
+
+    sweep_dir = os.path.join(base_dir, "outputs", "sweep")
+    fu.ensure_dir(sweep_dir)
+    out_fname = os.path.join(sweep_dir, "%s_%s_%s_sweep.npz" % \
+                                        (experiment_id, site, alloc_model))
+
+    (names, values) = ps.latin_hypercube(ranges, nsamples, seed=seed)
+    member = functools.partial(run_member, experiment_id=experiment_id,
+                               site=site, alloc_model=alloc_model,
+                               treatments=treatments, exps=exps)
+    nfailed = ps.run_sweep(member, names, values, out_fname,
+                           nworkers=nworkers)
+    if nfailed:
+        print "%d of %d members failed, see error in %s" % \
+                (nfailed, nsamples, out_fname)
+
+    return out_fname
+
+if __name__ == "__main__":
+
+    experiment_id = "FACE"
+    site = "EUC"
+    alloc_model = sys.argv[1] if len(sys.argv) > 1 else "FIXED"
+    nsamples = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    nworkers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    main(experiment_id, site, alloc_model, nsamples, nworkers=nworkers)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""
+EucFACE spin-up -> industrial -> amb/ele x avg/var simulations as a pipeline.
+
+For each alloc_model the spin-up, the industrial run and the four
+simulations (with their NCEAS translation) are stages, see
+runGday/scripts/pipeline.py. Rerunning only does the stages whose cfg, met,
+parameters or driver code changed since they last ran, and the independent
+ones (e.g. the alloc_models, the four simulations) run at the same time, e.g.
+
+    python eucface_pipeline.py 4
+"""
+import os
+import sys
+
+import eucface_spinup_to_equilibrium as spinup
+import eucface_simulations as sims
+
+__author__  = "Martin De Kauwe"
+__version__ = "1.0 (14.12.2014)"
+__email__   = "mdekauwe@gmail.com"
+
+def build(experiment_id, site, alloc_models, treatments, exps):
+    """ The stages for every alloc_model, treatment and exp """
+    base_dir = os.path.dirname(os.getcwd())
+    param_dir = os.path.join(base_dir, "params")
+    met_dir = os.path.join(base_dir, "met_data")
+    run_dir = os.path.join(base_dir, "outputs")
+    sys.path.append(os.path.join(os.path.dirname(base_dir), "scripts"))
+    import pipeline as pl
+
+    p = pl.Pipeline(os.path.join(base_dir, "cache", "pipeline"))
+    base_cfg_fname = os.path.join(spinup.BASE_PARAM_DIR, "base_start.cfg")
+    for alloc_model in alloc_models:
+        tag = "%s_%s_%s" % (experiment_id, site, alloc_model)
+        spunup_fname = os.path.join(param_dir, tag + "_model_spunup.cfg")
+        indust_fname = os.path.join(param_dir, tag + "_model_indust.cfg")
+
+        p.add(pl.Stage(tag + "_spin_up", spinup.main,
+                       inputs=[base_cfg_fname,
+                               os.path.join(met_dir,
+                               "%s_met_data_equilibrium_50_yrs.csv" % site)],
+                       outputs=[spunup_fname],
+                       params={"experiment_id": experiment_id, "site": site,
+                               "SPIN_UP": True, "POST_INDUST": False,
+                               "alloc_model": alloc_model}))
+        p.add(pl.Stage(tag + "_post_indust", spinup.main,
+                       inputs=[spunup_fname,
+                               os.path.join(met_dir,
+                               "%s_met_data_industrial_to_present_1750_2011.csv" \
+                               % site)],
+                       outputs=[indust_fname],
+                       params={"experiment_id": experiment_id, "site": site,
+                               "SPIN_UP": False, "POST_INDUST": True,
+                               "alloc_model": alloc_model}))
+        for treatment in treatments:
+            for exp in exps:
+                out_fn = "D1GDAY%s%s%s%s.csv" % (site, alloc_model,
+                                                 treatment.upper(),
+                                                 exp.upper())
+                p.add(pl.Stage("%s_simulation_%s_%s" % (tag, treatment, exp),
+                               sims.main,
+                               inputs=[indust_fname,
+                                       os.path.join(met_dir,
+                                       "%s_met_data_%s_%s_co2.csv" % \
+                                       (site, treatment, exp))],
+                               outputs=[os.path.join(run_dir, out_fn)],
+                               params={"experiment_id": experiment_id,
+                                       "site": site, "treatment": treatment,
+                                       "exp": exp, "alloc_model": alloc_model,
+                                       "indust_cfg_fname": indust_fname}))
+
+    return p
+
+def main(experiment_id, site, alloc_models, treatments=["amb", "ele"],
+         exps=["avg", "var"], nworkers=None, force=False):
+
+    p = build(experiment_id, site, alloc_models, treatments, exps)
+    status = p.run(nworkers=nworkers, force=force)
+    for stage in p.stages:
+        print "%-50s %s" % (stage.name, status[stage.name])
+
+    return status
+
+if __name__ == "__main__":
+
+    experiment_id = "FACE"
+    site = "EUC"
+    alloc_models  = ["FIXED", "ALLOMETRIC", "MAXIMIZEGPP","MAXIMIZEWOOD"]
+    nworkers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    main(experiment_id, site, alloc_models, nworkers=nworkers)
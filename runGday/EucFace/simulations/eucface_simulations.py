@@ -3,38 +3,93 @@
 """ 
 EucFACE Ambient/Elevated CO2 simulations.
 
+The scenario matrix (allocation model x treatment x exp) is independent so
+it is farmed out to a pool of worker processes, e.g.
+
+    python eucface_simulations.py 4
+
+runs it on four cores (default: all of them), and
+
+    python eucface_simulations.py 4 allocation
+
+only outputs what the allocation plots need.
 """
 import os
-import shutil
 import sys
+import Queue
+import traceback
 import subprocess
-from gday import gday as model
-from gday import adjust_gday_param_file as ad
+import threading
+import multiprocessing as mp
 from gday._version import __version__ as git_revision
 
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (14.12.2014)"
 __email__   = "mdekauwe@gmail.com"
 
-def main(experiment_id, site, treatment, exp, alloc_model = "fixed" ):
+def main(experiment_id, site, treatment, exp, alloc_model = "fixed",
+         scratch_dir=None, in_memory=False, archive_cfg=False, 
+         param_overrides=None, indust_cfg_fname=None, out_dir=None,
+         columnar=False, profile=False, follow=False, output_profile=None):
+    """ Run one scenario and translate it to NCEAS style output.
+    
+    With in_memory the model writes its daily output into a pipe which the 
+    translator reads as it goes, together with the met forcing we have 
+    already loaded, so the only file written is the final NCEAS one. With
+    follow the model writes its daily output as usual and a separate process
+    translates it as it grows, so translation finishes just after the model.
+    The adjusted cfg is only kept (in the scratch dir) with archive_cfg.
     
+    An output_profile (see OUTPUT_PROFILES in the translator), e.g. 
+    "allocation", switches off the model's [print] outputs it doesn't need
+    and only those NCEAS variables are written.
+    
+    A parameter sweep member starts from its own industrial run 
+    (indust_cfg_fname), overlays its param_overrides and writes to its own
+    out_dir.
+    
+    With profile the cost of each stage goes to a manifest next to out_fname,
+    see run_profiler.py.
+    """
     # dir names
     base_dir = os.path.dirname(os.getcwd())
     param_dir = os.path.join(base_dir, "params")
     met_dir = os.path.join(base_dir, "met_data")
-    run_dir = os.path.join(base_dir, "outputs")
+    run_dir = os.path.join(base_dir, "outputs") if out_dir is None else out_dir
+    met_cache_dir = os.path.join(base_dir, "cache", "met")
     
-    shutil.copy(os.path.join(param_dir, "%s_%s_model_indust.cfg" % (experiment_id, site)),
-                os.path.join(param_dir, "%s_%s_model_indust_adj_%s.cfg" % (experiment_id, site, exp)))
-
-    itag = "%s_%s_model_indust_adj_%s" % (experiment_id, site, exp)
-    otag = "%s_%s_%s_simulation_%s" % (experiment_id, site, alloc_model, exp)
+    # every scenario gets its own scratch dir so that concurrent runs never
+    # share the model's cfg
+    if scratch_dir is None:
+        scratch_dir = os.path.join(base_dir, "scratch", "%s_%s_%s_%s" % \
+                                    (experiment_id, alloc_model, treatment, 
+                                     exp))
+    
+    # add this directory to python search path so we can find the scripts!
+    sys.path.append(os.path.join(base_dir, "scripts"))
+    sys.path.append(os.path.join(os.path.dirname(base_dir), "scripts"))
+    import translate_GDAY_output_to_EUCFACE_format as tr
+    import gday_config as gc
+    import run_profiler as rp
+    import file_utils as fu
+    
+    for d in [scratch_dir, run_dir]:
+        fu.ensure_dir(d)
+    
+    itag = "%s_%s_model_indust_adj_%s_%s_%s" % (experiment_id, site, 
+                                               alloc_model, treatment, exp)
+    otag = "%s_%s_%s_simulation_%s_%s" % (experiment_id, site, alloc_model, 
+                                         treatment, exp)
     mtag = "%s_met_data_%s_%s_co2.csv" % (site, treatment, exp)
     out_fn = "D1GDAY%s%s%s%s.csv" % (site, alloc_model, treatment.upper(), exp.upper())
     out_param_fname = os.path.join(param_dir, otag + ".cfg")
-    cfg_fname = os.path.join(param_dir, itag + ".cfg")
+    cfg_fname = os.path.join(scratch_dir, itag + ".cfg")
     met_fname = os.path.join(met_dir, mtag)
     out_fname = os.path.join(run_dir, out_fn)
+    if indust_cfg_fname is None:
+        indust_cfg_fname = os.path.join(param_dir, "%s_%s_model_indust.cfg" % \
+                                        (experiment_id, site))
+    
     replace_dict = { 
                      # git stuff
                      "git_hash": str(git_revision),
@@ -50,17 +105,197 @@ def main(experiment_id, site, treatment, exp, alloc_model = "fixed" ):
                      "print_options": "daily",
                  
                     }
-    ad.adjust_param_file(cfg_fname, replace_dict)
-    G = model.Gday(cfg_fname)
-    G.run_sim()
+    if param_overrides is not None:
+        replace_dict.update(param_overrides)
+    if in_memory:
+        # model output goes straight into the translator
+        pipe_fname = os.path.join(scratch_dir, otag + ".pipe")
+        replace_dict["out_fname"] = pipe_fname
+    
+    profiler = rp.RunProfiler(enabled=profile, git_revision=str(git_revision),
+                              experiment_id=experiment_id, site=site,
+                              alloc_model=alloc_model, treatment=treatment, 
+                              exp=exp, in_memory=in_memory, follow=follow,
+                              output_profile=output_profile)
+    config = gc.GdayConfig.read(indust_cfg_fname).overlay(replace_dict)
+    if output_profile is not None:
+        # the [print] keys share names with the [state] pools
+        config = config.overlay_section("print", 
+                                        tr.print_settings(output_profile, 
+                                                    config.sections["print"]))
+    if archive_cfg:
+        config.write(cfg_fname)
+    
+    # the same few met files are shared by all the scenarios, so parse them
+    # once into the cache
+    with profiler.stage("load_met_input_data") as counts:
+        envir = tr.load_met_input_data(met_fname, parse_dates=False, 
+                                       cache_dir=met_cache_dir)
+        ndays = len(envir.values()[0])
+        counts["rows"] += ndays
+    if in_memory:
+        # the model and the translator run at the same time, so they can 
+        # only be timed together
+        with profiler.stage("run_sim_and_translate") as counts:
+            translate = PipeTranslator(tr, pipe_fname, met_fname, envir, 
+                                       out_fname, columnar, output_profile)
+            try:
+                with config.model(scratch_dir=scratch_dir) as G:
+                    G.run_sim()
+            finally:
+                translate.join()
+            counts["days"] += ndays
+    elif follow:
+        with profiler.stage("run_sim_and_translate") as counts:
+            # the translator would pick up the last run's output otherwise
+            if os.path.exists(out_fname):
+                os.remove(out_fname)
+            translate = TailTranslator(tr, out_fname, met_fname, envir, 
+                                       columnar, output_profile)
+            try:
+                with config.model(scratch_dir=scratch_dir) as G:
+                    G.run_sim()
+            except:
+                translate.join(abort=True)
+                raise
+            translate.join()
+            counts["days"] += ndays
+    else:
+        with profiler.stage("run_sim") as counts:
+            with config.model(scratch_dir=scratch_dir) as G:
+                G.run_sim()
+            counts["days"] += ndays
+        
+        # translate output to NCEAS style output
+        tr.translate_output(out_fname, met_fname, envir=envir, 
+                            columnar=columnar, profiler=profiler, 
+                            output_profile=output_profile)
+    profiler.write(out_fname)
+    
+    return out_fname
 
-    # translate output to NCEAS style output
+class PipeTranslator(object):
+    """ Translate whatever the model writes into pipe_fname on a thread, 
+    started before the model opens the pipe otherwise the model would block 
+    """
+    def __init__(self, tr, pipe_fname, met_fname, envir, out_fname, 
+                 columnar=False, output_profile=None):
+        if os.path.exists(pipe_fname):
+            os.remove(pipe_fname)
+        os.mkfifo(pipe_fname)
+        self.pipe_fname = pipe_fname
+        self.error = None
+        self.thread = threading.Thread(target=self.run, 
+                                       args=(tr, met_fname, envir, out_fname,
+                                             columnar, output_profile))
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def run(self, tr, met_fname, envir, out_fname, columnar, 
+            output_profile):
+        try:
+            tr.translate_output(self.pipe_fname, met_fname, envir=envir, 
+                                ofname=out_fname, columnar=columnar, 
+                                output_profile=output_profile)
+        except Exception as e:
+            self.error = e
+    
+    def join(self):
+        # if the model died before opening the pipe the translator is still
+        # waiting for a writer, open and close it to hand over an EOF
+        try:
+            os.close(os.open(self.pipe_fname, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+        self.thread.join()
+        os.remove(self.pipe_fname)
+        if self.error is not None:
+            raise self.error
 
-    # add this directory to python search path so we can find the scripts!
-    sys.path.append(os.path.join(base_dir, "scripts"))
-    import translate_GDAY_output_to_EUCFACE_format as tr
-    tr.translate_output(out_fname, met_fname)
-        
+class TailTranslator(object):
+    """ Translate out_fname in a separate process while the model writes it, 
+    join once the model is done. In a pool worker, which can't start 
+    processes of its own, it is a thread instead """
+    def __init__(self, tr, out_fname, met_fname, envir, columnar=False, 
+                 output_profile=None):
+        if mp.current_process().daemon:
+            (worker, self.errors) = (threading.Thread, Queue.Queue())
+        else:
+            (worker, self.errors) = (mp.Process, mp.Queue())
+        self.done = mp.Event()
+        self.abort = mp.Event()
+        self.worker = worker(target=self.run, 
+                             args=(tr, out_fname, met_fname, envir, 
+                                   columnar, output_profile))
+        self.worker.daemon = True
+        self.worker.start()
+    
+    def run(self, tr, out_fname, met_fname, envir, columnar, 
+            output_profile):
+        try:
+            tr.translate_output(out_fname, met_fname, envir=envir, 
+                                columnar=columnar, done=self.done, 
+                                abort=self.abort, 
+                                output_profile=output_profile)
+            self.errors.put(None)
+        except Exception:
+            self.errors.put(traceback.format_exc())
+    
+    def join(self, abort=False):
+        (self.abort if abort else self.done).set()
+        error = None
+        while True:
+            try:
+                error = self.errors.get(timeout=1.0)
+                break
+            except Queue.Empty:
+                if not self.worker.is_alive():
+                    error = "the translator died"
+                    break
+        self.worker.join()
+        if error is not None and not abort:
+            raise RuntimeError("translation failed\n%s" % error)
+
+def run_scenario(scenario):
+    """ Pool workers can only be handed a single picklable argument """
+    (experiment_id, site, treatment, exp, alloc_model, 
+     output_profile) = scenario
+    
+    return main(experiment_id, site, treatment=treatment, exp=exp, 
+                alloc_model=alloc_model, output_profile=output_profile)
+
+def run_scenarios(experiment_id, site, alloc_models, treatments, exps, 
+                  nworkers=None, output_profile=None):
+    """ Run the full alloc_model x treatment x exp matrix on a process pool
+    
+    Parameters:
+    ----------
+    nworkers : int
+        number of worker processes, None uses all the cores we have
+    output_profile : string
+        only output what this profile needs, e.g. "allocation", default 
+        everything
+    
+    Returns:
+    --------
+    out_fnames : list
+        NCEAS output file for each scenario, in matrix order
+    """
+    scenarios = [(experiment_id, site, treatment, exp, alloc_model, 
+                  output_profile)
+                 for alloc_model in alloc_models
+                 for treatment in treatments
+                 for exp in exps]
+    
+    pool = mp.Pool(processes=nworkers)
+    try:
+        # chunksize=1, runs differ wildly in cost between alloc models
+        out_fnames = pool.map(run_scenario, scenarios, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    
+    return out_fnames
     
 if __name__ == "__main__":
     
@@ -68,14 +303,11 @@ if __name__ == "__main__":
     experiment_id = "FACE"
     site = "EUC"
     alloc_models  = ["FIXED", "ALLOMETRIC", "MAXIMIZEGPP","MAXIMIZEWOOD"]
+    nworkers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    output_profile = sys.argv[2] if len(sys.argv) > 2 else None
     
-    for alloc_model in alloc_models:
-        # Ambient
-        main(experiment_id, site, treatment="amb", exp="avg", alloc_model=alloc_model)
-        main(experiment_id, site, treatment="amb", exp="var", alloc_model=alloc_model)
-    
-        # Elevated
-        main(experiment_id, site, treatment="ele", exp="avg", alloc_model=alloc_model)
-        main(experiment_id, site, treatment="ele", exp="var", alloc_model=alloc_model)
+    # Ambient & Elevated
+    run_scenarios(experiment_id, site, alloc_models, 
+                  treatments=["amb", "ele"], exps=["avg", "var"], 
+                  nworkers=nworkers, output_profile=output_profile)
     
-    
\ No newline at end of file
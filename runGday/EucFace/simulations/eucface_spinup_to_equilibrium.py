@@ -12,34 +12,65 @@ Spinup assuming a steady state forest.
 """
 
 import os
-import shutil
 import sys
 import subprocess
-from gday import gday as model
-from gday import adjust_gday_param_file as ad
 from gday._version import __version__ as git_revision
 
 __author__  = "Martin De Kauwe"
 __version__ = "1.0 (14.12.2014)"
 __email__   = "mdekauwe@gmail.com"
 
-def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, alloc_model = "FIXED"):
+# where base_start.cfg lives
+BASE_PARAM_DIR = "/Users/mq42056055/Documents/gdayFresh/example/params"
+
+def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, alloc_model = "FIXED",
+         use_cache=True, spin_up_tol=None, max_cycles=1000, archive_cfg=False,
+         param_overrides=None, profile=False, checkpoint_years=None,
+         resume=True, keep_checkpoints=False):
+    """ param_overrides, e.g. from a parameter sweep, go on top of the 
+    replace_dicts of both stages. With profile the cost of each stage goes to
+    a manifest next to each stage's out_fname, see run_profiler.py. 
+    
+    With spin_up_tol the met is recycled until the pools settle, for at most
+    max_cycles cycles. A spin-up that doesn't settle is carried on from but
+    not cached, see spinup_controller.py.
+    
+    With checkpoint_years the industrial run saves its state every that many
+    years and (with resume) carries on from the last one if it is rerun, see
+    checkpointed_run.py. The checkpoints are cleared once the run has 
+    finished, unless keep_checkpoints, in which case an experiment can start
+    from the end of any checkpointed year of the industrial run (otag), e.g.
+    1900
+    
+        ckpt_dir = os.path.join(base_dir, "checkpoints", otag)
+        config = cr.branch(gc.GdayConfig.read(out_param_fname), ckpt_dir, 
+                           1900)
+    
+    then overlay its own met_fname (starting in 1901), out_fname and 
+    out_param_fname and run_sim it as usual. """
     
     # dir names
     base_param_name = "base_start"
     base_dir = os.path.dirname(os.getcwd())
-    base_param_dir = "/Users/mq42056055/Documents/gdayFresh/example/params"
+    base_param_dir = BASE_PARAM_DIR
     param_dir = os.path.join(base_dir, "params")
     met_dir = os.path.join(base_dir, "met_data")
     run_dir = os.path.join(base_dir, "outputs")
+    cache_dir = os.path.join(base_dir, "cache", "spinup")
+    
+    # site independent helpers live one level up
+    sys.path.append(os.path.join(os.path.dirname(base_dir), "scripts"))
+    import spinup_controller as spc
+    import gday_config as gc
+    import run_profiler as rp
+    import checkpointed_run as cr
+    
+    profiler = rp.RunProfiler(enabled=profile, git_revision=str(git_revision),
+                              experiment_id=experiment_id, site=site,
+                              alloc_model=alloc_model)
 
     if SPIN_UP == True:
         
-        # copy base files to make two new experiment files
-        shutil.copy(os.path.join(base_param_dir, base_param_name + ".cfg"),                
-                    os.path.join(param_dir, "%s_%s_model_spinup.cfg" % \
-                                                (experiment_id, site)))
-        
         # Run model to equilibrium assuming forest, growing C pools from effectively
         # zero
         itag = "%s_%s_model_spinup"    % (experiment_id, site)
@@ -47,6 +78,7 @@ def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, alloc_model = "FIX
         mtag = "%s_met_data_equilibrium_50_yrs.csv" % (site)
         out_fn = itag + alloc_model + "_equilib.out"
         
+        base_cfg_fname = os.path.join(base_param_dir, base_param_name + ".cfg")
         out_param_fname = os.path.join(param_dir, otag + ".cfg")
         cfg_fname = os.path.join(param_dir, itag + ".cfg")
         met_fname = os.path.join(met_dir, mtag)
@@ -212,20 +244,27 @@ def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, alloc_model = "FIX
                         "sw_stress_model": "1",  # Sands and Landsberg
                          
         }
+        if param_overrides is not None:
+            replace_dict.update(param_overrides)
         
-        ad.adjust_param_file(cfg_fname, replace_dict)
-        G = model.Gday(cfg_fname, spin_up=True)
-        G.spin_up_pools()
+        # recycle the met until the pools stop changing (with spin_up_tol),
+        # or reuse the cached spun-up state
+        trace_fname = os.path.join(run_dir, otag + "_convergence.csv")
+        spc.spin_up(base_cfg_fname, replace_dict, met_fname, out_param_fname,
+                    trace_fname, git_revision, cache_dir, use_cache=use_cache,
+                    tol=spin_up_tol, max_cycles=max_cycles,
+                    cfg_fname=cfg_fname if archive_cfg else None,
+                    profiler=profiler)
+        profiler.write(out_fname)
 
     if POST_INDUST == True:
 
         # run for 260 odd years post industrial with increasing co2/ndep
 
-        # copy spunup base files to make two new experiment files
-        
-        
-        shutil.copy(os.path.join(param_dir, "%s_%s_%s_model_spunup.cfg" % (experiment_id, site, alloc_model)),
-                    os.path.join(param_dir, "%s_%s_%s_model_spunup_adj.cfg" % (experiment_id, site, alloc_model)))
+        # start from the spunup state, the adjusted copy is only written out
+        # if we want to archive it
+        spunup_fname = os.path.join(param_dir, "%s_%s_%s_model_spunup.cfg" % \
+                                    (experiment_id, site, alloc_model))
 
         itag = "%s_%s_%s_model_spunup_adj" % (experiment_id, site,alloc_model)
         otag = "%s_%s_%s_model_indust" % (experiment_id, site, alloc_model)
@@ -249,9 +288,24 @@ def main(experiment_id, site, SPIN_UP=True, POST_INDUST=True, alloc_model = "FIX
                         
                          
                         }
-        ad.adjust_param_file(cfg_fname, replace_dict)
-        G = model.Gday(cfg_fname)
-        G.run_sim()
+        if param_overrides is not None:
+            replace_dict.update(param_overrides)
+        config = gc.GdayConfig.read(spunup_fname).overlay(replace_dict)
+        if archive_cfg:
+            config.write(cfg_fname)
+        with profiler.stage("run_sim %s" % out_fn) as counts:
+            if checkpoint_years is None:
+                with config.model() as G:
+                    G.run_sim()
+            else:
+                ckpt_dir = os.path.join(base_dir, "checkpoints", otag)
+                cr.run_checkpointed(config, met_fname, out_fname, 
+                                    out_param_fname, ckpt_dir, 
+                                    every=checkpoint_years, resume=resume,
+                                    keep=keep_checkpoints)
+            if profile:
+                counts["days"] += rp.count_days(met_fname)
+        profiler.write(out_fname)
 
 if __name__ == "__main__":
 
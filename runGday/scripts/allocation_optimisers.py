@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Daily optimisers for the MAXIMIZEGPP and MAXIMIZEWOOD allocation models
+
+MaxGPP (docs/AllocationModels/MaxGPP.tex) picks the leaf allocation that
+gives the most GPP when the model is run forward a day, every day. Each cost
+evaluation is a day-ahead model step, so what matters is how many of them we
+make. Here the candidates are handed over as whole arrays, so a vectorised
+day-ahead GPP does a grid of A_leaf in one call, the grid is then zoomed in
+on the best point, and each day starts from a small bracket around the day
+before's optimum rather than the full [0, A_leaf,max] range. MaxW
+(docs/AllocationModels/MaxW.tex) is the same search in two dimensions, over
+(A_leaf, A_wood) pairs.
+
+The day-ahead GPP itself lives in the model, it is passed in as a function
+of arrays of candidate allocations. batched() wraps a model that can only
+do one candidate at a time.
+"""
+import numpy as np
+
+def batched(func):
+    """ Turn a one candidate at a time day-ahead function into one taking
+    arrays, e.g. batched(lambda aleaf: G.gpp_ahead(aleaf)) """
+
+    return lambda *args: np.array([func(*a) for a in zip(*args)])
+
+def zoom_grid_search(cost, lower, upper, start=None, width=0.2, npoints=9,
+                     tol=1E-3, max_evals=None):
+    """ Minimise a vectorised cost over a box
+
+    A grid of npoints per dimension is evaluated in a single call to cost,
+    the box then shrinks to the cells either side of the best point and we go
+    again. With a start the first box is only width (fraction of the bounds)
+    wide, and is slid along if the best point ends up on its edge.
+
+    Parameters:
+    ----------
+    cost : function
+        cost(x) for an (n, ndim) array of points, returns n costs
+    lower, upper : array
+        bounds for each dimension
+    start : array
+        warm start, e.g. yesterday's optimum
+    width : float
+        size of the warm start box as a fraction of the bounds
+    npoints : int
+        grid points per dimension for each call
+    tol : float
+        stop once the grid spacing is below this fraction of the bounds
+    max_evals : int
+        evaluation budget, None for no limit
+
+    Returns:
+    --------
+    x : array
+        best point found
+    fx : float
+        cost at x
+    nevals : int
+        number of points evaluated
+    ncalls : int
+        number of calls to cost
+    converged : logical
+        did we get to tol within the budget
+    """
+    lower = np.atleast_1d(np.asarray(lower, dtype=np.float64))
+    upper = np.atleast_1d(np.asarray(upper, dtype=np.float64))
+    span = upper - lower
+    ndim = len(lower)
+    if start is None:
+        (lo, hi) = (lower.copy(), upper.copy())
+    else:
+        start = np.clip(np.atleast_1d(start), lower, upper)
+        lo = np.maximum(lower, start - 0.5 * width * span)
+        hi = np.minimum(upper, start + 0.5 * width * span)
+
+    (best_x, best_f) = (None, np.inf)
+    (nevals, ncalls, converged) = (0, 0, False)
+    while True:
+        axes = [np.linspace(l, h, npoints) for (l, h) in zip(lo, hi)]
+        grid = np.array(np.meshgrid(*axes, indexing="ij")).reshape(ndim, -1).T
+        f = np.asarray(cost(grid), dtype=np.float64)
+        f = np.where(np.isnan(f), np.inf, f)
+        nevals += len(grid)
+        ncalls += 1
+
+        i = np.argmin(f)
+        improved = best_x is None or f[i] < best_f
+        if improved:
+            (best_x, best_f) = (grid[i], f[i])
+        cell = np.unravel_index(i, (npoints,) * ndim)
+
+        # zoom in on the best point, unless a new best is sat on the edge of
+        # a warm start box in which case the optimum is probably outside it.
+        # Only sliding on an improvement means we can't go back and forth
+        (new_lo, new_hi) = (lo.copy(), hi.copy())
+        sliding = False
+        for d in xrange(ndim):
+            step = (hi[d] - lo[d]) / (npoints - 1)
+            k = cell[d]
+            if improved and ((k == 0 and lo[d] > lower[d]) or
+                             (k == npoints - 1 and hi[d] < upper[d])):
+                sliding = True
+                w = hi[d] - lo[d]
+                new_lo[d] = max(lower[d], min(best_x[d] - 0.5 * w,
+                                              upper[d] - w))
+                new_hi[d] = new_lo[d] + w
+            else:
+                new_lo[d] = max(lower[d], best_x[d] - step)
+                new_hi[d] = min(upper[d], best_x[d] + step)
+
+        steps = (hi - lo) / (npoints - 1)
+        if not sliding and np.all(steps <= tol * span):
+            converged = True
+            break
+        if max_evals is not None and nevals + npoints**ndim > max_evals:
+            break
+        (lo, hi) = (new_lo, new_hi)
+
+    return best_x, best_f, nevals, ncalls, converged
+
+class MaxGPPOptimiser(object):
+    """ Daily optimal leaf allocation for MAXIMIZEGPP
+
+    minimise -GPP(GDAY_d+1(A_leaf)) subject to 0 <= A_leaf <= A_leaf,max,
+    starting each day from the last optimum. nevals counts the day-ahead
+    model evaluations, so nevals / ndays is what each simulated day costs.
+    """
+    def __init__(self, npoints=9, tol=1E-3, width=0.2, max_evals=None):
+        self.npoints = npoints
+        self.tol = tol
+        self.width = width
+        self.max_evals = max_evals
+        self.reset()
+
+    def reset(self):
+        """ Forget the warm start and the counters, e.g. for a new run """
+        self.previous = None
+        self.nevals = 0
+        self.ncalls = 0
+        self.ndays = 0
+
+    def optimise(self, gpp_ahead, aleaf_max):
+        """ Today's optimal leaf allocation
+
+        Parameters:
+        ----------
+        gpp_ahead : function
+            next day's GPP for an array of candidate leaf allocations
+        aleaf_max : float
+            upper bound on leaf allocation
+
+        Returns:
+        --------
+        aleaf : float
+            optimal leaf allocation
+        """
+        cost = lambda x: -np.asarray(gpp_ahead(x[:,0]), dtype=np.float64)
+        (x, fx, nevals, ncalls, converged) = zoom_grid_search(
+                                        cost, [0.0], [aleaf_max],
+                                        start=self.previous,
+                                        width=self.width,
+                                        npoints=self.npoints, tol=self.tol,
+                                        max_evals=self.max_evals)
+        self.nevals += nevals
+        self.ncalls += ncalls
+        self.ndays += 1
+        self.previous = x
+
+        return x[0]
+
+    def evals_per_day(self):
+        return self.nevals / float(max(self.ndays, 1))
+
+class MaxWoodOptimiser(object):
+    """ Daily optimal leaf and wood allocation for MAXIMIZEWOOD
+
+    minimise -GPP(GDAY_d+1(A_leaf, A_wood)) * A_wood over 
+    0 <= A_leaf <= A_leaf,max and 0 <= A_wood <= A_wood,max, optionally with
+    A_leaf + A_wood <= max_total, starting each day from the last optimum.
+    
+    Every call to optimise appends a record to stats: the optimum, its cost,
+    number of evaluations and calls, and whether it got to tol within 
+    max_evals.
+    """
+    def __init__(self, npoints=7, tol=1E-3, width=0.2, max_evals=2000,
+                 max_total=None):
+        self.npoints = npoints
+        self.tol = tol
+        self.width = width
+        self.max_evals = max_evals
+        self.max_total = max_total
+        self.reset()
+
+    def reset(self):
+        """ Forget the warm start and the statistics, e.g. for a new run """
+        self.previous = None
+        self.stats = []
+
+    def optimise(self, gpp_ahead, aleaf_max, awood_max=None):
+        """ Today's optimal leaf and wood allocation
+
+        Parameters:
+        ----------
+        gpp_ahead : function
+            next day's GPP for arrays of candidate leaf and wood allocations
+        aleaf_max : float
+            upper bound on leaf allocation
+        awood_max : float
+            upper bound on wood allocation, the docs use aleaf_max for both
+            so that is the default
+
+        Returns:
+        --------
+        aleaf : float
+            optimal leaf allocation
+        awood : float
+            optimal wood allocation
+        """
+        if awood_max is None:
+            awood_max = aleaf_max
+        
+        def cost(x):
+            phi = (-np.asarray(gpp_ahead(x[:,0], x[:,1]), dtype=np.float64) * 
+                   x[:,1])
+            if self.max_total is not None:
+                phi[x.sum(axis=1) > self.max_total] = np.inf
+            return phi
+        
+        (x, fx, nevals, ncalls, converged) = zoom_grid_search(
+                                        cost, [0.0, 0.0], 
+                                        [aleaf_max, awood_max],
+                                        start=self.previous,
+                                        width=self.width,
+                                        npoints=self.npoints, tol=self.tol,
+                                        max_evals=self.max_evals)
+        self.previous = x
+        self.stats.append({"aleaf": x[0], "awood": x[1], "cost": fx, 
+                           "nevals": nevals, "ncalls": ncalls, 
+                           "converged": converged})
+        
+        return x[0], x[1]
+
+    def summary(self):
+        """ Totals over the days so far """
+        ndays = len(self.stats)
+        nevals = sum(s["nevals"] for s in self.stats)
+        
+        return {"ndays": ndays, "nevals": nevals,
+                "ncalls": sum(s["ncalls"] for s in self.stats),
+                "evals_per_day": nevals / float(max(ndays, 1)),
+                "unconverged_days": sum(not s["converged"] 
+                                        for s in self.stats)}
+
+def self_check():
+    """ Optima and evaluation counts on analytic day-ahead functions, so a
+    change to the zoom or the warm start box shows up as a failure here """
+    # cold start, one dimension, optimum at 0.37
+    (x, fx, nevals, ncalls, converged) = zoom_grid_search(
+                                    lambda x: (x[:,0] - 0.37)**2, [0.0], [1.0])
+    assert abs(x[0] - 0.37) < 1E-3 and converged
+    assert (nevals, ncalls) == (45, 5), (nevals, ncalls)
+
+    # MaxGPP, the next day starts from a bracket around the last optimum
+    opt = MaxGPPOptimiser()
+    for (day, optimum) in enumerate([0.37, 0.38]):
+        aleaf = opt.optimise(lambda a: 1.0 - (a - optimum)**2, 1.0)
+        assert abs(aleaf - optimum) < 1E-3, (day, aleaf)
+    assert opt.nevals == 45 + 36, opt.nevals
+
+    # MaxW, -GPP * A_wood with GPP = 1 - (A_leaf - 0.4)^2 - (A_wood - 0.25)^2
+    # is smallest at A_leaf = 0.4, A_wood = 0.75
+    opt = MaxWoodOptimiser()
+    (aleaf, awood) = opt.optimise(lambda l, w: 1.0 - (l - 0.4)**2 - 
+                                  (w - 0.25)**2, 1.0)
+    assert abs(aleaf - 0.4) < 1E-3 and abs(awood - 0.75) < 1E-3, \
+           (aleaf, awood)
+    assert opt.summary()["nevals"] == 294, opt.summary()
+
+if __name__ == "__main__":
+
+    self_check()
+    print "ok"
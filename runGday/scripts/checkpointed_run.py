@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Long runs in segments, with a checkpoint after each one
+
+The industrial run (1750-2011) is a single run_sim, if it dies late all of it
+is lost. Here the met file is cut into every-N-year segments, each segment
+is an ordinary run_sim started from the state the last one finished in, and
+after each segment the [state] pools are saved as a small .npz snapshot in
+ckpt_dir (state_<year>.npz, the state at the end of that year). Daily output,
+if the run prints it, is appended to out_fname as we go.
+
+A run that died picks up from its latest checkpoint with resume. The
+checkpoints only count for the run that made them, ckpt_dir/manifest.json
+holds a hash of the starting config, the met forcing and every, and anything
+left by a different run is thrown away. They are cleared once the run has
+finished, unless kept, in which case an experiment can branch off any
+checkpointed year without rerunning what came before, e.g.
+
+    config = branch(spunup_config, ckpt_dir, 1900)
+    run_checkpointed(config, met_from_1901_fname, out_fname, out_param_fname,
+                     branch_ckpt_dir)
+
+As with the spin-up -> industrial restart, only what G'DAY keeps in the cfg
+carries across a segment boundary.
+"""
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import numpy as np
+from gday_config import GdayConfig
+from file_utils import file_hash, ensure_dir, atomic_write
+
+# comment lines and the header at the top of a met file
+MET_HEADER_LINES = 5
+
+def split_met(met_fname, seg_dir, nyears, header_lines=MET_HEADER_LINES):
+    """ Cut a met file into nyears long segments, each with the full header
+
+    Returns:
+    --------
+    segments : list
+        (first year, last year, segment met file) for each segment
+    """
+    segments = []
+    with open(met_fname) as f:
+        header = [f.readline() for i in xrange(header_lines)]
+        (out, first) = (None, None)
+        for line in f:
+            year = int(float(line.split(",", 1)[0]))
+            if first is None or year >= first + nyears:
+                if out is not None:
+                    out.close()
+                    segments.append((first, last, out.name))
+                first = year
+                out = open(os.path.join(seg_dir, "met_%d.csv" % year), "w")
+                out.writelines(header)
+            out.write(line)
+            last = year
+        if out is not None:
+            out.close()
+            segments.append((first, last, out.name))
+
+    return segments
+
+def save_state(config, fname, out_size=0):
+    """ [state] pools as a compact binary snapshot, the odd non-numeric entry
+    (e.g. None) is kept as text. out_size is how much of the output file goes
+    with this state """
+    (names, values, text_names, text_values) = ([], [], [], [])
+    for (key, value) in config.sections["state"].items():
+        try:
+            values.append(float(value))
+            names.append(key)
+        except ValueError:
+            text_names.append(key)
+            text_values.append(value)
+
+    with atomic_write(fname, "wb", suffix=".npz") as f:
+        np.savez(f, names=np.array(names), values=np.array(values),
+                 text_names=np.array(text_names),
+                 text_values=np.array(text_values),
+                 out_size=np.array(out_size))
+
+def load_state(fname):
+    """ ({pool: value as it would appear in the cfg}, output size) """
+    with np.load(fname) as data:
+        state = dict((str(k), repr(float(v))) for (k, v) in
+                     zip(data["names"], data["values"]))
+        state.update((str(k), str(v)) for (k, v) in
+                     zip(data["text_names"], data["text_values"]))
+        out_size = int(data["out_size"])
+
+    return state, out_size
+
+def checkpoints(ckpt_dir):
+    """ [(year, snapshot)] in year order """
+    found = []
+    for fname in glob.glob(os.path.join(ckpt_dir, "state_*.npz")):
+        match = re.match(r"state_(\d+)\.npz$", os.path.basename(fname))
+        if match:
+            found.append((int(match.group(1)), fname))
+
+    return sorted(found)
+
+def branch(config, ckpt_dir, year):
+    """ config with the state from the end of year """
+    fname = os.path.join(ckpt_dir, "state_%d.npz" % year)
+    if not os.path.exists(fname):
+        raise ValueError("no checkpoint for %d in %s" % (year, ckpt_dir))
+
+    return config.overlay_section("state", load_state(fname)[0])
+
+def run_key(config, met_fname, every):
+    """ Hash of what the checkpoints depend on, the starting config, the met
+    forcing and the segment length """
+    h = hashlib.sha1()
+    h.update(json.dumps(config.sections).encode("utf-8"))
+    h.update(("every=%d\n" % every).encode("utf-8"))
+
+    return file_hash(met_fname, h)
+
+def clear_checkpoints(ckpt_dir):
+    for fname in [f for (year, f) in checkpoints(ckpt_dir)] + \
+                 [os.path.join(ckpt_dir, "manifest.json")]:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+def claim(ckpt_dir, key):
+    """ Keep the checkpoints in ckpt_dir if they were made by the run with 
+    this key, otherwise clear them and mark the dir as this run's """
+    manifest_fname = os.path.join(ckpt_dir, "manifest.json")
+    try:
+        with open(manifest_fname) as f:
+            if json.load(f)["key"] == key:
+                return
+    except (IOError, ValueError, KeyError):
+        pass
+    clear_checkpoints(ckpt_dir)
+    with atomic_write(manifest_fname) as f:
+        json.dump({"key": key}, f)
+
+def append_output(seg_out_fname, out_fname):
+    """ Add the segment's daily output to out_fname, the git revision and
+    header lines only the first time. Returns the size of out_fname """
+    if os.path.exists(seg_out_fname):
+        new = not os.path.exists(out_fname) or os.path.getsize(out_fname) == 0
+        with open(seg_out_fname) as fin:
+            with open(out_fname, "a") as fout:
+                if not new:
+                    fin.readline()
+                    fin.readline()
+                shutil.copyfileobj(fin, fout)
+
+    return os.path.getsize(out_fname) if os.path.exists(out_fname) else 0
+
+def run_checkpointed(config, met_fname, out_fname, out_param_fname, ckpt_dir,
+                     every=10, resume=True, scratch_dir=None, keep=False):
+    """ run_sim over met_fname every years at a time, checkpointing as we go
+
+    Parameters:
+    ----------
+    config : GdayConfig
+        starting state, params and control, e.g. the spun-up cfg
+    met_fname : string
+        met forcing for the whole run
+    out_fname : string
+        daily output for the whole run, appended to segment by segment
+    out_param_fname : string
+        final state, as written by an ordinary run
+    ckpt_dir : string
+        where the segments and the state snapshots go
+    every : int
+        years between checkpoints
+    resume : logical
+        start from the latest checkpoint in ckpt_dir, if there is one and it
+        was made by this run
+    keep : logical
+        keep the checkpoints once the run has finished, e.g. to branch
+
+    Returns:
+    --------
+    nsegments : int
+        segments actually run
+    """
+    ensure_dir(ckpt_dir)
+    claim(ckpt_dir, run_key(config, met_fname, every))
+    segments = split_met(met_fname, ckpt_dir, every)
+    seg_out_fname = os.path.join(ckpt_dir, "segment.out")
+    seg_param_fname = os.path.join(ckpt_dir, "segment.cfg")
+
+    # carry on after the run of segments that are already checkpointed
+    start = 0
+    done = dict(checkpoints(ckpt_dir)) if resume else {}
+    while start < len(segments) and segments[start][1] in done:
+        start += 1
+    if start > 0:
+        (state, out_size) = load_state(done[segments[start - 1][1]])
+        config = config.overlay_section("state", state)
+
+        # throw away anything written after the checkpoint
+        if os.path.exists(out_fname):
+            with open(out_fname, "r+") as f:
+                f.truncate(out_size)
+    else:
+        for (year, fname) in checkpoints(ckpt_dir):
+            os.remove(fname)
+        if os.path.exists(out_fname):
+            os.remove(out_fname)
+
+    for (first, last, seg_met_fname) in segments[start:]:
+        for fname in [seg_out_fname, seg_param_fname]:
+            if os.path.exists(fname):
+                os.remove(fname)
+        seg_config = config.overlay({"met_fname": seg_met_fname,
+                                     "out_fname": seg_out_fname,
+                                     "out_param_fname": seg_param_fname})
+        with seg_config.model(scratch_dir=scratch_dir) as G:
+            G.run_sim()
+        if not os.path.exists(seg_param_fname):
+            raise RuntimeError("segment %d-%d didn't write its end state to "
+                               "%s" % (first, last, seg_param_fname))
+
+        out_size = append_output(seg_out_fname, out_fname)
+        end = GdayConfig.read(seg_param_fname)
+        save_state(end, os.path.join(ckpt_dir, "state_%d.npz" % last),
+                   out_size)
+        config = config.overlay_section("state", end.sections["state"])
+
+    # the final state, as if it had been one run
+    final = config.overlay({"met_fname": met_fname, "out_fname": out_fname,
+                            "out_param_fname": out_param_fname})
+    final.write(out_param_fname)
+    for fname in [f for (first, last, f) in segments] + [seg_out_fname,
+                                                         seg_param_fname]:
+        if os.path.exists(fname):
+            os.remove(fname)
+    if not keep:
+        clear_checkpoints(ckpt_dir)
+
+    return len(segments) - start
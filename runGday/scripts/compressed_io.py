@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Plain, gzip or zstd files, by extension
+
+Met forcing, G'DAY output and the NCEAS translations can be kept compressed
+(.gz, or .zst/.zstd with the zstandard package installed), open_stream hands
+back a file object that compresses or decompresses on the fly so nothing is
+unpacked to a temp file first.
+"""
+import io
+import os
+import gzip
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+# compressed files are recognised by their extension
+COMPRESSION = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+def compression(fname):
+    """ gzip, zstd or None, from the extension of fname """
+
+    return COMPRESSION.get(os.path.splitext(fname)[1].lower())
+
+def open_stream(fname, mode="r", like=None):
+    """ Open fname for reading ("r") or writing ("w"), compressed or
+    decompressed on the fly if its extension, or that of like (e.g. the file
+    a temp file will become), says so. zstd needs the zstandard package """
+    kind = compression(like if like is not None else fname)
+    if kind is None:
+        return open(fname, mode)
+    elif kind == "gzip":
+        return gzip.open(fname, mode + "b")
+    elif zstd is None:
+        raise IOError("can't open %s, zstandard isn't installed" % fname)
+    elif mode == "r":
+        return io.BufferedReader(zstd.ZstdDecompressor().stream_reader(
+                                                        open(fname, "rb")))
+    else:
+        return zstd.ZstdCompressor().stream_writer(open(fname, "wb"))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" File helpers shared by the drivers, caches and manifests
+
+Everything we write that another process might read at the same time (the
+caches, manifests, checkpoints and translated outputs) goes to a temp file
+next to it and is renamed into place, so a reader never sees a partial file.
+The renames are atomic as long as the temp file is on the same filesystem,
+hence next to the file rather than in the system temp dir, e.g.
+
+    with atomic_write(manifest_fname) as f:
+        json.dump(manifest, f)
+"""
+import os
+import hashlib
+import tempfile
+import contextlib
+
+def file_hash(fname, h=None):
+    """ sha1 hex digest of fname, read a block at a time. Given h (a hashlib
+    object) fname is added to it instead, e.g. to hash it along with the
+    other inputs of a run, and h's digest is returned """
+    if h is None:
+        h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+def ensure_dir(dirname):
+    """ makedirs, unless it is already there, e.g. another worker made it
+    first """
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+@contextlib.contextmanager
+def atomic_fname(fname, suffix=".tmp", dirname=None):
+    """ Name of a temp file for the with block to write, renamed to fname at
+    the end, or removed if the block raises. The temp file is in dirname,
+    which must be on the same filesystem as fname, by default next to it """
+    if dirname is None:
+        dirname = os.path.dirname(fname) or "."
+    (fd, tmp_fname) = tempfile.mkstemp(dir=dirname, suffix=suffix)
+    os.close(fd)
+    try:
+        yield tmp_fname
+        os.rename(tmp_fname, fname)
+    except:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise
+
+@contextlib.contextmanager
+def atomic_write(fname, mode="w", suffix=".tmp"):
+    """ As atomic_fname, but the temp file is opened (with mode) for the with
+    block """
+    with atomic_fname(fname, suffix) as tmp_fname:
+        with open(tmp_fname, mode) as f:
+            yield f
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Run several forcing scenarios from the same starting state at once
+
+The traceability runs each copied the spun-up cfg onto one shared _trace.cfg
+name and rebuilt the model from it, one after the other. Here the spun-up
+config is loaded once in the parent, the pool workers are forked from it (so
+they share that copy, copy-on-write) and each scenario overlays its own
+replace_dict and runs in its own process, with its own temporary cfg.
+
+Scenarios must not share an out_fname or out_param_fname, that is checked
+before anything runs. This relies on fork, as on linux and the mac, and from
+inside a pool worker the scenarios run in turn instead.
+"""
+import traceback
+import multiprocessing as mp
+
+# the starting state, set in the parent before the pool forks
+SHARED = {}
+
+def run_scenario(job):
+    """ Runs in the forked worker """
+    (name, replace_dict, scratch_dir) = job
+    if "config" not in SHARED:
+        return name, "no shared state, the workers weren't forked"
+    try:
+        config = SHARED["config"].overlay(replace_dict)
+        with config.model(scratch_dir=scratch_dir) as G:
+            G.run_sim()
+        return name, None
+    except Exception:
+        return name, traceback.format_exc()
+
+def fork_scenarios(config, scenarios, nworkers=None, scratch_dir=None):
+    """ Run every scenario from config, concurrently
+
+    Parameters:
+    ----------
+    config : GdayConfig
+        the shared starting point, e.g. the spun-up cfg
+    scenarios : list
+        (name, replace_dict) for each scenario, the replace_dict giving at
+        least its met_fname, out_fname and out_param_fname
+    nworkers : int
+        number of worker processes, default one per scenario
+    scratch_dir : string
+        where each run's temporary cfg goes
+
+    Returns:
+    --------
+    names : list
+        the scenarios, in order, once they have all finished
+    """
+    for key in ["out_fname", "out_param_fname"]:
+        fnames = [replace_dict.get(key, config[key])
+                  for (name, replace_dict) in scenarios]
+        if len(set(fnames)) < len(fnames):
+            raise ValueError("scenarios share a %s" % key)
+
+    jobs = [(name, replace_dict, scratch_dir)
+            for (name, replace_dict) in scenarios]
+    SHARED["config"] = config
+    try:
+        if mp.current_process().daemon:
+            # already a pool worker (e.g. a pipeline stage), which can't have
+            # children of its own, so one after the other
+            results = [run_scenario(job) for job in jobs]
+        else:
+            pool = mp.Pool(processes=nworkers or len(scenarios))
+            try:
+                results = pool.map(run_scenario, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        SHARED.clear()
+
+    failed = [(name, error) for (name, error) in results if error is not None]
+    if failed:
+        raise RuntimeError("\n".join("scenario %s failed\n%s" % f
+                                     for f in failed))
+
+    return [name for (name, error) in results]
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" G'DAY cfg files held in memory
+
+The drivers used to shutil.copy a cfg to a new _adj/_trace name, rewrite it
+on disk with adjust_param_file and have the model read it straight back. Here
+the cfg is parsed once into [git], [files], [params], [state], [control] and
+[print] sections, the replace_dicts are overlaid on a copy in memory and the
+model is built from that. A cfg only hits the disk when we ask to archive it,
+or for the life of a run, as a private temp file, because G'DAY itself will
+only read from a file.
+"""
+import os
+import tempfile
+import contextlib
+import ConfigParser
+from collections import OrderedDict
+from gday import gday as model
+from file_utils import atomic_write
+
+SECTIONS = ["git", "files", "params", "state", "control", "print"]
+
+class GdayConfig(object):
+    """ Parsed G'DAY cfg
+
+    Parameters:
+    ----------
+    sections : dictionary
+        {section: {key: value}}, the values as they appear in the cfg
+    """
+    def __init__(self, sections=None):
+        self.sections = OrderedDict((s, OrderedDict()) for s in SECTIONS)
+        if sections is not None:
+            for (section, options) in sections.items():
+                self.sections.setdefault(section, OrderedDict()).update(options)
+
+    @classmethod
+    def read(cls, fname):
+        parser = ConfigParser.RawConfigParser()
+        parser.optionxform = str
+        # unlike parser.read, this complains if the file isn't there
+        with open(fname) as f:
+            parser.readfp(f)
+
+        return cls(OrderedDict((s, OrderedDict(parser.items(s)))
+                               for s in parser.sections()))
+
+    def copy(self):
+        return GdayConfig(self.sections)
+
+    def overlay(self, *replace_dicts):
+        """ Copy of the config with each replace_dict applied in turn
+
+        As with adjust_param_file, a key is replaced in whichever section it
+        is found and keys that aren't in the cfg are ignored.
+        """
+        config = self.copy()
+        for replace_dict in replace_dicts:
+            for options in config.sections.values():
+                for key in options:
+                    if key in replace_dict:
+                        options[key] = str(replace_dict[key])
+
+        return config
+
+    def overlay_section(self, section, replace_dict):
+        """ Copy of the config with replace_dict applied to section alone,
+        for keys that are in more than one section, e.g. [print] shoot and
+        [state] shoot
+        """
+        config = self.copy()
+        options = config.sections[section]
+        for key in options:
+            if key in replace_dict:
+                options[key] = str(replace_dict[key])
+
+        return config
+
+    def __getitem__(self, key):
+        for options in self.sections.values():
+            if key in options:
+                return options[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return any(key in options for options in self.sections.values())
+
+    def write(self, fname):
+        """ Archive the config, a concurrent reader never sees half a cfg """
+        with atomic_write(fname) as f:
+            for (section, options) in self.sections.items():
+                if not options:
+                    continue
+                f.write("[%s]\n" % section)
+                for (key, value) in options.items():
+                    f.write("%s = %s\n" % (key, value))
+                f.write("\n")
+
+    @contextlib.contextmanager
+    def model(self, spin_up=False, scratch_dir=None):
+        """ G'DAY built from this config, e.g.
+
+            with config.model() as G:
+                G.run_sim()
+
+        The model reads its cfg (and cfg_fname is where it looks for it when
+        saving the final state) so a uniquely named copy is kept in
+        scratch_dir (default: the system temp dir) until the run is done.
+        """
+        (fd, cfg_fname) = tempfile.mkstemp(dir=scratch_dir, suffix=".cfg")
+        os.close(fd)
+        try:
+            self.overlay({"cfg_fname": cfg_fname}).write(cfg_fname)
+            yield model.Gday(cfg_fname, spin_up=spin_up)
+        finally:
+            os.remove(cfg_fname)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Parameter sweeps over the replace_dict parameters
+
+The allocation bounds (c_alloc_fmax/fmin/rmax/rmin), targ_sens, leafsap0/1,
+g1, vcmaxna etc were being tuned by editing the spin-up replace_dicts by hand.
+Here a design (full grid or Latin hypercube) is drawn over parameter ranges
+and every member is run on a process pool by a site specific member function,
+e.g. spin-up, industrial and experiment stages, which hands back a few
+summary numbers. Those all go into a single .npz, one array per parameter and
+per result, with row i being sample i.
+"""
+import traceback
+import multiprocessing as mp
+import numpy as np
+from file_utils import atomic_write
+
+def grid(ranges, npoints):
+    """ Full factorial design
+
+    Parameters:
+    ----------
+    ranges : dictionary
+        {parameter: (lower, upper)}
+    npoints : int or dictionary
+        points along each parameter, or {parameter: points}
+
+    Returns:
+    --------
+    names : list
+        parameter names, sorted
+    values : array
+        (nsamples, nparameters) parameter values for each member
+    """
+    names = sorted(ranges)
+    if not isinstance(npoints, dict):
+        npoints = dict((k, npoints) for k in names)
+    axes = [np.linspace(ranges[k][0], ranges[k][1], npoints[k]) for k in names]
+    mesh = np.meshgrid(*axes, indexing="ij")
+
+    return names, np.column_stack([m.ravel() for m in mesh])
+
+def latin_hypercube(ranges, nsamples, seed=None):
+    """ Latin hypercube design, each parameter's range is cut into nsamples
+    strata and every stratum is sampled exactly once
+
+    Parameters:
+    ----------
+    ranges : dictionary
+        {parameter: (lower, upper)}
+    nsamples : int
+        number of members
+    seed : int
+        random seed, so a design can be redrawn
+
+    Returns:
+    --------
+    names : list
+        parameter names, sorted
+    values : array
+        (nsamples, nparameters) parameter values for each member
+    """
+    rng = np.random.RandomState(seed)
+    names = sorted(ranges)
+    values = np.empty((nsamples, len(names)))
+    for (j, k) in enumerate(names):
+        (lower, upper) = ranges[k]
+        u = (rng.permutation(nsamples) + rng.rand(nsamples)) / nsamples
+        values[:,j] = lower + u * (upper - lower)
+
+    return names, values
+
+def run_member(job):
+    """ Pool workers can only be handed a single picklable argument. A
+    member that falls over is recorded rather than taking the sweep down """
+    (member, sample_id, params) = job
+    try:
+        return sample_id, member(sample_id, params), None
+    except Exception:
+        return sample_id, None, traceback.format_exc()
+
+def run_sweep(member, names, values, out_fname, nworkers=None):
+    """ Run every member of a design and store the results
+
+    Parameters:
+    ----------
+    member : function
+        member(sample_id, params) -> {result: value}, params being
+        {parameter: value} ready to overlay on a replace_dict. It has to be
+        picklable, so a module level function (or a functools.partial of
+        one), and every member needs to return the same results.
+    names, values : list, array
+        the design, e.g. from grid or latin_hypercube
+    out_fname : string
+        .npz the results are written to
+    nworkers : int
+        number of worker processes, None uses all the cores we have
+
+    Returns:
+    --------
+    nfailed : int
+        number of members that raised
+    """
+    jobs = [(member, i, dict(zip(names, row))) for (i, row) in
+            enumerate(values)]
+
+    pool = mp.Pool(processes=nworkers)
+    try:
+        # chunksize=1, members differ wildly in cost
+        results = pool.map(run_member, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    store(out_fname, names, values, results)
+
+    return sum(error is not None for (i, result, error) in results)
+
+def store(out_fname, names, values, results):
+    """ One array per parameter and per result, indexed by sample id. Failed
+    members get NaN results and their traceback in error """
+    nsamples = len(values)
+    results = sorted(results, key=lambda r: r[0])
+    done = [r for r in results if r[2] is None]
+    result_names = sorted(done[0][1]) if done else []
+    clash = set(result_names) & set(names)
+    if clash:
+        raise ValueError("results named like parameters: %s" %
+                         ", ".join(sorted(clash)))
+
+    columns = {"sample_id": np.arange(nsamples),
+               "parameter_names": np.array(names),
+               "result_names": np.array(result_names),
+               "failed": np.array([r[2] is not None for r in results]),
+               "error": np.array([r[2] or "" for r in results])}
+    for (j, k) in enumerate(names):
+        columns[k] = np.asarray(values)[:,j]
+    for k in result_names:
+        shape = np.shape(done[0][1][k])
+        column = np.empty((nsamples,) + shape)
+        column.fill(np.nan)
+        for (i, result, error) in done:
+            column[i] = result[k]
+        columns[k] = column
+
+    # a half written sweep never looks finished
+    with atomic_write(out_fname, "wb", suffix=".npz") as f:
+        np.savez(f, **columns)
+
+def load_sweep(fname):
+    """ Everything in a sweep file as a dictionary of arrays """
+    with np.load(fname) as data:
+        return dict((k, data[k]) for k in data.files)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Spin-up -> industrial -> experiment runs as a pipeline of stages
+
+The site drivers hard-wire the chain and gate it with SPIN_UP/POST_INDUST/
+SPIN_UP_SIMS flags, so changing one experiment parameter meant rerunning the
+lot or editing flags. Here each stage declares the files it reads, the
+parameters it is called with and the files it writes. A stage depends on
+whichever stages write its inputs, stages whose dependencies are done run in
+parallel on a process pool, and a stage is skipped when its inputs (by
+content), parameters and function (and the source file it is in) are the
+same as at its last successful run and its outputs are still there.
+
+    p = Pipeline(state_dir)
+    p.add(Stage("spin_up", spinup.main, inputs=[base_cfg, met],
+                outputs=[spunup_cfg], params={...}))
+    ...
+    status = p.run(nworkers=4)
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import hashlib
+import traceback
+import multiprocessing as mp
+from file_utils import file_hash, ensure_dir, atomic_write
+
+class Stage(object):
+    """ One step of the pipeline
+
+    Parameters:
+    ----------
+    name : string
+        unique name, also names the stage's record in the state dir
+    func : function
+        called as func(**params) in a worker process, so it must be
+        picklable, i.e. a module level function
+    inputs : list
+        files the stage reads (cfg, met ...)
+    outputs : list
+        files the stage writes
+    params : dictionary
+        keyword arguments for func, part of the stage's hash
+    """
+    def __init__(self, name, func, inputs=(), outputs=(), params=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params if params is not None else {}
+
+    def stamp(self):
+        """ Hash of everything that decides what the stage produces. The
+        source file of func counts as an input, the replace_dicts live in the
+        drivers """
+        h = hashlib.sha1()
+        h.update(("%s.%s\n" % (self.func.__module__,
+                               self.func.__name__)).encode("utf-8"))
+        for (key, value) in sorted(self.params.items()):
+            h.update(("%s=%r\n" % (key, value)).encode("utf-8"))
+        for fname in [inspect.getsourcefile(self.func)] + self.inputs:
+            h.update(("%s\n" % os.path.abspath(fname)).encode("utf-8"))
+            file_hash(fname, h)
+
+        return h.hexdigest()
+
+def run_stage(func, params):
+    """ Runs in the worker, hands back the traceback rather than raising so
+    that the scheduler can carry on with the stages that don't need this one
+    """
+    try:
+        func(**params)
+        return None
+    except Exception:
+        return traceback.format_exc()
+
+class Pipeline(object):
+    """ Stages and the scheduler that runs them
+
+    Parameters:
+    ----------
+    state_dir : string
+        where the stamp of each stage's last successful run is kept
+    """
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.stages = []
+        self.errors = {}
+
+    def add(self, stage):
+        if stage.name in [s.name for s in self.stages]:
+            raise ValueError("stage %s added twice" % stage.name)
+        self.stages.append(stage)
+
+        return stage
+
+    def dependencies(self):
+        """ {stage name: names of the stages that write its inputs} """
+        writer = {}
+        for stage in self.stages:
+            for fname in stage.outputs:
+                fname = os.path.abspath(fname)
+                if fname in writer:
+                    raise ValueError("%s and %s both write %s" % \
+                                     (writer[fname], stage.name, fname))
+                writer[fname] = stage.name
+
+        deps = {}
+        for stage in self.stages:
+            deps[stage.name] = set(writer[os.path.abspath(f)]
+                                   for f in stage.inputs
+                                   if os.path.abspath(f) in writer)
+            deps[stage.name].discard(stage.name)
+
+        return deps
+
+    def stamp_fname(self, stage):
+        return os.path.join(self.state_dir, stage.name + ".json")
+
+    def up_to_date(self, stage, stamp):
+        if not all(os.path.exists(f) for f in stage.outputs):
+            return False
+        try:
+            with open(self.stamp_fname(stage)) as f:
+                return json.load(f)["stamp"] == stamp
+        except (IOError, ValueError, KeyError):
+            return False
+
+    def record(self, stage, stamp):
+        """ Remember a successful run """
+        with atomic_write(self.stamp_fname(stage)) as f:
+            json.dump({"stamp": stamp, "outputs": stage.outputs,
+                       "finished": time.strftime("%Y-%m-%dT%H:%M:%S")}, f)
+
+    def run(self, nworkers=None, force=False, poll=0.5):
+        """ Run (or skip) every stage, dependencies first
+
+        Parameters:
+        ----------
+        nworkers : int
+            number of worker processes, None uses all the cores we have
+        force : logical
+            rerun stages even if they are up to date
+        poll : float
+            seconds between checks on the running stages
+
+        Returns:
+        --------
+        status : dictionary
+            {stage name: "ran", "skipped", "failed" or "blocked"}, blocked
+            stages needed a stage that failed
+        """
+        ensure_dir(self.state_dir)
+
+        deps = self.dependencies()
+        stages = dict((s.name, s) for s in self.stages)
+        pending = [s.name for s in self.stages]
+        (status, errors, running) = ({}, {}, {})
+
+        pool = mp.Pool(processes=nworkers)
+        try:
+            while pending or running:
+                # keep going until nothing more can start, a skip can free up
+                # stages we have already looked at
+                changed = True
+                while changed:
+                    changed = False
+                    for name in list(pending):
+                        if any(status.get(d) in ["failed", "blocked"]
+                               for d in deps[name]):
+                            status[name] = "blocked"
+                        elif all(status.get(d) in ["ran", "skipped"]
+                                 for d in deps[name]):
+                            self.start(stages[name], pool, force, status,
+                                       errors, running)
+                        else:
+                            continue
+                        pending.remove(name)
+                        changed = True
+                if pending and not running:
+                    raise ValueError("dependency cycle between %s" % \
+                                     ", ".join(pending))
+
+                for name in [n for n in running if running[n][0].ready()]:
+                    (result, stamp) = running.pop(name)
+                    error = result.get()
+                    if error is None:
+                        self.record(stages[name], stamp)
+                        status[name] = "ran"
+                    else:
+                        (status[name], errors[name]) = ("failed", error)
+                        sys.stderr.write("stage %s failed\n%s\n" % \
+                                         (name, error))
+
+                if running and not any(r.ready() for (r, s) in
+                                       running.values()):
+                    time.sleep(poll)
+        finally:
+            pool.close()
+            pool.join()
+        self.errors = errors
+
+        return status
+
+    def start(self, stage, pool, force, status, errors, running):
+        """ Skip the stage if it is up to date, otherwise hand it to the pool
+        """
+        # hash the inputs now, the stages upstream have written them
+        try:
+            stamp = stage.stamp()
+        except (IOError, OSError) as e:
+            (status[stage.name], errors[stage.name]) = ("failed", str(e))
+            return
+        if not force and self.up_to_date(stage, stamp):
+            status[stage.name] = "skipped"
+        else:
+            running[stage.name] = (pool.apply_async(run_stage, (stage.func,
+                                                            stage.params)),
+                                   stamp)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Windowed daily statistics with O(1) updates
+
+The MaxGPP and MaxW allocation models use the average of the daily optimal
+allocations over the past n days (a year, or since the start of the growing
+season), and the allometric model's overall limitation L is the sum of the
+daily min(N_lim, W_root) over the root lifespan
+(docs/requiredChanges/Limitation.tex). Re-summing the history every day adds
+up over multi-century spin-ups, so the last n days are kept in a fixed size
+ring buffer along with their running sum.
+
+A window can be saved to, and restored from, its own .npz. The snapshots in
+checkpointed_run.py only hold the [state] G'DAY keeps in its cfg, not these.
+"""
+import numpy as np
+
+def npz_fname(fname):
+    """ np.savez adds .npz if it isn't there, so save and load agree """
+    return fname if fname.endswith(".npz") else fname + ".npz"
+
+class RollingWindow(object):
+    """ The last size daily values, with their running sum
+
+    Parameters:
+    ----------
+    size : int
+        number of days in the window
+    shape : tuple
+        shape of each day's value, e.g. (2,) for leaf and wood allocation
+    """
+    def __init__(self, size, shape=()):
+        if size < 1:
+            raise ValueError("window needs at least one day")
+        self.values = np.zeros((int(size),) + tuple(shape))
+        self.reset()
+
+    def reset(self):
+        """ Empty the window, e.g. at the start of the growing season """
+        self.values.fill(0.0)
+        self.total = np.zeros(self.values.shape[1:])
+        self.pos = 0
+        self.count = 0
+
+    def add(self, value):
+        """ Add today's value, dropping the oldest once the window is full """
+        size = len(self.values)
+        self.total += value - self.values[self.pos]
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % size
+        self.count = min(self.count + 1, size)
+
+        # the running sum picks up round-off, so re-sum each time we wrap.
+        # That is once every size days, so still O(1) a day on average
+        if self.pos == 0:
+            self.total = self.values.sum(axis=0)
+
+    def sum(self):
+        return self.total.copy() if self.total.ndim else float(self.total)
+
+    def mean(self):
+        """ Average over the days we have, up to size """
+        return self.sum() / max(self.count, 1)
+
+    def get_state(self):
+        """ Everything needed to carry on from here """
+        return {"values": self.values.copy(), "total": np.array(self.total),
+                "pos": self.pos, "count": self.count}
+
+    def set_state(self, state):
+        self.values = np.array(state["values"], dtype=np.float64)
+        self.total = np.array(state["total"], dtype=np.float64)
+        self.pos = int(state["pos"])
+        self.count = int(state["count"])
+
+    def save(self, fname):
+        np.savez(npz_fname(fname), **self.get_state())
+
+    @classmethod
+    def load(cls, fname):
+        window = cls.__new__(cls)
+        with np.load(npz_fname(fname)) as state:
+            window.set_state(state)
+
+        return window
+
+class Limitation(RollingWindow):
+    """ Overall limitation L, the sum of the daily limitation
+    l = min(N_lim, W_root) over the root lifespan """
+    def __init__(self, root_lifespan):
+        RollingWindow.__init__(self, root_lifespan)
+
+    def add_day(self, nlim, wroot):
+        self.add(min(nlim, wroot))
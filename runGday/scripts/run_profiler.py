@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" What each stage of a run cost
+
+Opt-in instrumentation for the drivers. Each stage is timed in a with block
+and the wall time, CPU time, peak RSS, rows processed and simulated days per
+second end up in a JSON manifest next to the run's out_fname, tagged with the
+git revision, alloc_model, treatment, exp etc, e.g.
+
+    profiler = RunProfiler(enabled=profile, alloc_model=alloc_model)
+    with profiler.stage("run_sim") as s:
+        G.run_sim()
+        s["days"] += ndays
+    profiler.write(out_fname)
+
+A stage entered more than once (e.g. once per chunk) adds up. Each write only
+takes the stages recorded since the last one, so a driver writing a manifest
+after every stage doesn't repeat the earlier stages in the later manifests,
+and the manifests of a run add up to its total. With enabled False the stages
+cost nothing and nothing is written.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import contextlib
+from collections import OrderedDict
+from compressed_io import open_stream
+from file_utils import atomic_write
+
+def peak_rss_mb():
+    """ High water mark of this process's resident memory """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on a mac, kilobytes on linux
+    return rss / (1024.0**2 if sys.platform == "darwin" else 1024.0)
+
+def cpu_seconds():
+    (user, system) = os.times()[:2]
+
+    return user + system
+
+def count_days(met_fname):
+    """ Days in a met file, i.e. the days the model will simulate: the data 
+    rows, not the # comments and header, of a plain or compressed file """
+    with contextlib.closing(open_stream(met_fname)) as f:
+        return sum(1 for line in f if line.strip() and 
+                   not line.lstrip().startswith("#"))
+
+def manifest_fname(out_fname):
+    return os.path.splitext(out_fname)[0] + "_profile.json"
+
+class RunProfiler(object):
+    """ Stage timings for one run
+
+    Parameters:
+    ----------
+    enabled : logical
+        record anything at all
+    tags : keywords
+        stored at the top of the manifest, e.g. git_revision, alloc_model,
+        treatment and exp
+    """
+    def __init__(self, enabled=True, **tags):
+        self.enabled = enabled
+        self.tags = tags
+        self.stages = OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Time the with block. Add to the yielded record's rows (and days,
+        if the stage simulates or translates days) as the work gets done """
+        counts = {"rows": 0, "days": 0}
+        if not self.enabled:
+            yield counts
+            return
+
+        (wall0, cpu0) = (time.time(), cpu_seconds())
+        try:
+            yield counts
+        finally:
+            record = self.stages.setdefault(name, {"calls": 0, "wall_s": 0.0,
+                                                   "cpu_s": 0.0, "rows": 0,
+                                                   "days": 0})
+            record["calls"] += 1
+            record["wall_s"] += time.time() - wall0
+            record["cpu_s"] += cpu_seconds() - cpu0
+            record["rows"] += counts["rows"]
+            record["days"] += counts["days"]
+            record["peak_rss_mb"] = peak_rss_mb()
+
+    def summary(self):
+        """ Stage records with the rates filled in """
+        stages = OrderedDict()
+        for (name, record) in self.stages.items():
+            record = dict(record)
+            wall = max(record["wall_s"], 1E-9)
+            record["rows_per_s"] = record["rows"] / wall
+            record["days_per_s"] = record["days"] / wall
+            stages[name] = record
+
+        return stages
+
+    def write(self, out_fname, **tags):
+        """ Manifest next to out_fname, <out_fname base>_profile.json, of the
+        stages since the last write. tags, e.g. the scenario, are added to
+        the ones the profiler was made with """
+        if not self.enabled:
+            return None
+
+        manifest = OrderedDict([("out_fname", out_fname),
+                                ("created", time.strftime("%Y-%m-%dT%H:%M:%S")),
+                                ("host", socket.gethostname()),
+                                ("pid", os.getpid())])
+        manifest.update(sorted(dict(self.tags, **tags).items()))
+        manifest["peak_rss_mb"] = peak_rss_mb()
+        manifest["stages"] = self.summary()
+        self.stages = OrderedDict()
+
+        fname = manifest_fname(out_fname)
+        with atomic_write(fname) as f:
+            json.dump(manifest, f, indent=2)
+
+        return fname
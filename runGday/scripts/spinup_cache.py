@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Cache of spun-up equilibrium states
+
+Spinning the model up is by far the slowest stage, and we were redoing it for
+every allocation model and every rerun even when nothing had changed. The
+spun-up cfg is stored under a hash of everything that goes into the spin-up:
+the base cfg, the replace_dict, the equilibrium met file and the git revision.
+"""
+import os
+import shutil
+import hashlib
+from file_utils import file_hash, ensure_dir, atomic_write
+
+# these only say where things get written, they don't change the answer
+IGNORE_KEYS = ["out_param_fname", "cfg_fname", "met_fname", "out_fname"]
+
+def spinup_key(base_cfg_fname, replace_dict, met_fname, git_revision):
+    """ Hash of the spin-up inputs 
+    
+    Parameters:
+    ----------
+    base_cfg_fname : string
+        copy of base_start.cfg, *before* it has been adjusted
+    replace_dict : dictionary
+        parameters/state/control passed to adjust_param_file
+    met_fname : string
+        equilibrium met forcing file
+    git_revision : string
+        model version
+    
+    Returns:
+    --------
+    key : string
+        hex digest identifying the spun-up state
+    """
+    h = hashlib.sha1()
+    h.update(str(git_revision).encode("utf-8"))
+    for (key, value) in sorted(replace_dict.items()):
+        if key not in IGNORE_KEYS:
+            h.update(("%s=%s\n" % (key, value)).encode("utf-8"))
+    for fname in [base_cfg_fname, met_fname]:
+        file_hash(fname, h)
+    
+    return h.hexdigest()
+
+def fetch(cache_dir, key, out_param_fname):
+    """ Copy a cached spun-up cfg to out_param_fname, returns False on a miss """
+    cached_fname = os.path.join(cache_dir, key + ".cfg")
+    if not os.path.exists(cached_fname):
+        return False
+    shutil.copy(cached_fname, out_param_fname)
+    
+    return True
+
+def store(cache_dir, key, out_param_fname):
+    """ Add the spun-up cfg written by the model to the cache """
+    ensure_dir(cache_dir)
+    with atomic_write(os.path.join(cache_dir, key + ".cfg"), "wb") as f:
+        with open(out_param_fname, "rb") as fin:
+            shutil.copyfileobj(fin, f)
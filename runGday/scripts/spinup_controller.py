@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# coding: utf-8
+""" Spin-up to convergence
+
+Rather than leaving it all to G.spin_up_pools(), recycle the equilibrium met
+forcing one pass at a time, look at how much the SOM, plant and litter pools
+moved over that cycle and stop as soon as none of them is changing by more
+than a relative tolerance. The per-cycle change is written out as we go so
+we can see how (and whether) the slow pools are getting there.
+
+Each cycle is an ordinary run_sim over the met file, the final state it writes
+to out_param_fname is the starting state of the next cycle.
+
+spin_up is the whole spin-up stage as the drivers run it: fetch the spun-up
+cfg from the cache (see spinup_cache.py), else spin up and store it, but only
+if the pools actually got to equilibrium.
+"""
+import sys
+import csv
+import spinup_cache as sc
+import run_profiler as rp
+from gday_config import GdayConfig
+
+# SOM, plant and litter C pools we wait on
+POOLS = ["activesoil", "slowsoil", "passivesoil", "metabsoil", "structsoil",
+         "metabsurf", "structsurf", "shoot", "stem", "branch", "root",
+         "croot"]
+
+def read_state(config, pools=POOLS):
+    """ Pool sizes from the [state] section of a GdayConfig """
+
+    return dict((p, float(config.sections["state"][p])) for p in pools)
+
+def relative_change(old, new, tiny=1E-12):
+    return abs(new - old) / max(abs(old), tiny)
+
+def spin_up_to_convergence(config, out_param_fname, trace_fname,
+                           tol=1E-3, max_cycles=1000, pools=POOLS,
+                           scratch_dir=None):
+    """ Run met cycles from cfg_fname until the pools stop changing
+
+    Parameters:
+    ----------
+    config : GdayConfig
+        starting cfg, already overlaid, with the equilibrium met as met_fname
+    out_param_fname : string
+        where the spun-up cfg ends up (as with spin_up_pools)
+    trace_fname : string
+        csv of the pools and their relative change after every cycle
+    tol : float
+        stop once no pool changes by more than this fraction over a cycle
+    max_cycles : int
+        give up after this many cycles
+    scratch_dir : string
+        where each cycle's temporary cfg goes
+
+    Returns:
+    --------
+    converged : logical
+        did we get within tol before max_cycles
+    ncycles : int
+        number of met cycles run
+    """
+    config = config.overlay({"out_param_fname": out_param_fname,
+                             "print_options": "end"})
+
+    previous = read_state(config, pools)
+    converged = False
+    with open(trace_fname, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["cycle", "max_rel_change"] + pools +
+                        ["d_" + p for p in pools])
+        for cycle in xrange(1, max_cycles + 1):
+            with config.model(scratch_dir=scratch_dir) as G:
+                G.run_sim()
+
+            # the end state of this cycle is the start of the next
+            config = GdayConfig.read(out_param_fname)
+            current = read_state(config, pools)
+            change = [relative_change(previous[p], current[p]) for p in pools]
+            writer.writerow([cycle, max(change)] +
+                            [current[p] for p in pools] + change)
+            f.flush()
+
+            if max(change) < tol:
+                converged = True
+                break
+            previous = current
+
+    return converged, cycle
+
+def spin_up(base_cfg_fname, replace_dict, met_fname, out_param_fname,
+            trace_fname, git_revision, cache_dir, use_cache=True, tol=None,
+            max_cycles=1000, cfg_fname=None, profiler=None):
+    """ Spin the model up from base_cfg_fname, unless the cache already has it
+
+    Parameters:
+    ----------
+    base_cfg_fname : string
+        base_start.cfg
+    replace_dict : dictionary
+        overlaid on the base cfg for the spin-up
+    met_fname : string
+        equilibrium met forcing file
+    out_param_fname : string
+        where the spun-up cfg ends up
+    trace_fname : string
+        convergence trace, see spin_up_to_convergence
+    git_revision : string
+        model version, part of the cache key
+    cache_dir : string
+        spin-up cache, see spinup_cache.py
+    use_cache : logical
+        fetch from and add to the cache
+    tol : float
+        recycle the met until no pool changes by more than this fraction,
+        None leaves it to G.spin_up_pools()
+    max_cycles : int
+        give up on tol after this many met cycles
+    cfg_fname : string
+        archive the spin-up cfg here, None doesn't
+    profiler : RunProfiler
+        time the cache fetch and the spin-up
+
+    Returns:
+    --------
+    converged : logical
+        False if the pools were still moving after max_cycles, the state
+        isn't cached then
+    ncycles : int
+        met cycles run, 0 if it came from the cache or spin_up_pools
+    """
+    if profiler is None:
+        profiler = rp.RunProfiler(enabled=False)
+
+    # skip the spin-up if we have already done it with the same inputs
+    key_dict = dict(replace_dict)
+    if tol is not None:
+        key_dict["spin_up_tol"] = str(tol)
+    key = sc.spinup_key(base_cfg_fname, key_dict, met_fname, git_revision)
+    with profiler.stage("spin_up_cache_fetch"):
+        if use_cache and sc.fetch(cache_dir, key, out_param_fname):
+            return True, 0
+
+    config = GdayConfig.read(base_cfg_fname).overlay(replace_dict)
+    if cfg_fname is not None:
+        config.write(cfg_fname)
+    (converged, ncycles) = (True, 0)
+    with profiler.stage("spin_up") as counts:
+        if tol is None:
+            with config.model(spin_up=True) as G:
+                G.spin_up_pools()
+        else:
+            (converged, ncycles) = spin_up_to_convergence(
+                                        config, out_param_fname, trace_fname,
+                                        tol=tol, max_cycles=max_cycles)
+            if profiler.enabled:
+                counts["days"] += ncycles * rp.count_days(met_fname)
+
+    if not converged:
+        # carry on from where it got to, but don't let a later run take
+        # this for an equilibrium
+        sys.stderr.write("spin-up not within %g after %d cycles, see %s, "
+                         "not caching %s\n" % (tol, ncycles, trace_fname,
+                                                out_param_fname))
+    elif use_cache:
+        sc.store(cache_dir, key, out_param_fname)
+
+    return converged, ncycles